@@ -1,8 +1,7 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io as sp
-from hamming_weight import hamming_weight
-from aes_scripts.aes_crypt_8bit_and_leak import aes_crypt_8bit_and_leak, aes_sbox
+from attack_lib import cpa, cpa_hypothesis, dpa, dpa_selection
 
 #  Differential power analysis and correlation power analysis
 DPA = 0
@@ -39,37 +38,18 @@ def main():
 	trace_classification = np.zeros(shape=(2**8, input_count))
 	inputs = ws2['inputs']
 
-	for key_guess in range(2**8):
-		# For each plaintext input
-		for input in range(input_count):
-			# Calculate what the value of S[P ^ K] is
-			p_xor_k = np.bitwise_xor(inputs[input, key_byte_to_guess - 1], key_guess)
-			s_p_xor_k = aes_sbox(p_xor_k, 1)
-
-			if dpa_or_cpa == DPA:
-				trace_classification[key_guess, input] = (np.bitwise_and(s_p_xor_k, 1) != 0)
-			else:
-				trace_classification[key_guess, input] = hamming_weight(s_p_xor_k)
-
-		# % Calculate the mean of each classified set
-		if dpa_or_cpa == DPA:
-			mean_for_1 = np.mean(traces[trace_classification[key_guess, :] == 1, :])
-			mean_for_0 = np.mean(traces[trace_classification[key_guess, :] == 0, :])
-			# % Save the difference of means in the table
-			classification_output[key_guess, :] = mean_for_1 - mean_for_0
-		else:
-			shape = np.shape(trace_classification[key_guess, :])
-			my_trace = np.reshape(trace_classification[key_guess, :], newshape=(shape[0], 1))
-
-			traces1 = (traces - traces.mean(axis=0))/traces.std(axis=0)  # A matrix
-			my_trace = (my_trace - my_trace.mean(axis=0))/my_trace.std(axis=0)  # B matrix
-			correlation = (np.dot(my_trace.T, traces1) / my_trace.shape[0])[0]
-
-			classification_output[key_guess, :] = np.transpose(correlation)
-
-		print('[{:02x}]'.format(key_guess), end=" ")
-		if (key_guess % 16) == 15:
-			print('\n')
+	if dpa_or_cpa == DPA:
+		# Calculate bit 0 of S[P ^ K] for all key guesses and inputs at once,
+		# then the per-sample difference of means of the two classified sets
+		selection = dpa_selection(inputs, key_byte_to_guess - 1, 0)
+		trace_classification = np.transpose(selection)
+		classification_output = dpa(traces, selection)
+	else:
+		# Calculate the HW of S[P ^ K] for all key guesses and inputs at once,
+		# then correlate all of them with the traces in one matrix product
+		hypothesis = cpa_hypothesis(inputs, key_byte_to_guess - 1)
+		trace_classification = np.transpose(hypothesis)
+		classification_output = cpa(traces, hypothesis)
 
 	# #
 	#  Plot the trace classification matrix
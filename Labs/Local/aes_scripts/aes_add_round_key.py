@@ -40,12 +40,9 @@ import numpy as np
 
 
 def aes_add_round_key(key, data):
-	key_len = np.shape(key)[1]
+	key = np.uint8(np.reshape(key, (1, -1)))
+	data = np.uint8(np.reshape(data, (-1, np.shape(key)[1])))
 
-	result = np.uint8(np.zeros(np.size(data)))
-	key = np.asmatrix(key)
-	# do add_roundkey column by colomn
-	for i in range(key_len):
-		# print(key[0, i], data[0, i])
-		result[i] = np.bitwise_xor(key[0, i], data[0, i])
+	# the key row is broadcast over every line of 'data'
+	result = np.bitwise_xor(key, data)
 	return np.asmatrix(result)
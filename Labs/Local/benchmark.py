@@ -0,0 +1,203 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+
+#  make aes_lib / hamming_weight from the Labs folder importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aes_lib import aes_crypt_8bit_and_leak, aes_crypt_partial, aes_sbox, AES_SBOX, AES_SBOX_HW
+from hamming_weight import bit_count
+from attack_lib import cpa_hypothesis, CpaAccumulator, parallel_accumulate
+from trace_lib import accumulate, trace_chunks, trace_store_create
+from leakage_lib import SnrAccumulator, TtestAccumulator
+from preprocess_lib import align_traces
+from profiling_lib import Projection, RegressionAccumulator, TemplateAccumulator, TemplateAttack
+from simulate_lib import simulate_chunks, simulate_store, simulated_samples
+
+
+#  Micro-benchmarks for the Labs library functions. Each benchmark prints
+#  how many calls (or items) per second the function sustains.
+
+
+def report(name, count, seconds, unit='calls'):
+	print('{:<48s} {:>14,.0f} {}/s'.format(name, count / seconds, unit))
+
+
+def best_of(stmt, number, repeat=5):
+	return min(timeit.repeat(stmt, number=number, repeat=repeat))
+
+
+def aes_sbox_rebuilt(input_data, encrypt):
+	#  the previous aes_sbox: the table is rebuilt from a Python list per call
+	table = np.uint8(AES_SBOX.tolist())
+	return table[np.array(input_data)]
+
+
+def bench_aes_sbox():
+	number = 20000
+	p_xor_k = np.uint8(0x3c)
+	report('aes_sbox scalar (table rebuilt per call)', number, best_of(lambda: aes_sbox_rebuilt(p_xor_k, 1), number))
+	report('aes_sbox scalar (module-level table)', number, best_of(lambda: aes_sbox(p_xor_k, 1), number))
+
+	data = np.random.randint(0, 256, size=200, dtype=np.uint8)
+	out = np.empty_like(data)
+	report('aes_sbox 200 bytes (table rebuilt per call)', number, best_of(lambda: aes_sbox_rebuilt(data, 1), number))
+	report('aes_sbox 200 bytes (module-level table)', number, best_of(lambda: aes_sbox(data, 1), number))
+	report('aes_sbox 200 bytes (out= buffer)', number, best_of(lambda: aes_sbox(data, 1, out=out), number))
+
+
+def cpa_hypothesis_xor(inputs, key_byte, model=AES_SBOX_HW):
+	#  the previous cpa_hypothesis: an N x 256 XOR, then the model lookup
+	p = np.uint8(np.asarray(inputs)[:, key_byte])
+	return np.asarray(model)[np.bitwise_xor(p[:, np.newaxis], np.arange(256, dtype=np.uint8))]
+
+
+def bench_hypothesis():
+	inputs = np.random.randint(0, 256, size=(100000, 16), dtype=np.uint8)
+	key = np.arange(16, dtype=np.uint8)
+	report('aes_crypt_8bit_and_leak (all 41 states)', 100000, best_of(lambda: aes_crypt_8bit_and_leak(inputs, key, 1), 1, 3), 'traces')
+	report('aes_crypt_partial B1', 100000, best_of(lambda: aes_crypt_partial(inputs, key, 1, 'B1'), 1), 'traces')
+	report('cpa_hypothesis (XOR, then model lookup)', 100000, best_of(lambda: cpa_hypothesis_xor(inputs, 0), 1), 'traces')
+	report('cpa_hypothesis (256 x 256 table gather)', 100000, best_of(lambda: cpa_hypothesis(inputs, 0), 1), 'traces')
+
+
+def bench_bit_count():
+	data = np.random.randint(0, 256, size=10**7, dtype=np.uint8)
+	report('bit_count uint8', np.size(data), best_of(lambda: bit_count(data), 1), 'bytes')
+	data = data.view(np.uint32)
+	report('bit_count uint32', np.size(data), best_of(lambda: bit_count(data), 1), 'words')
+
+
+def bench_parallel_cpa():
+	#  one key byte on a synthetic store, with 1, 2, 4, ... worker processes
+	count, length = 20000, 2000
+	path = tempfile.mkdtemp()
+	try:
+		rng = np.random.default_rng(0)
+		store = trace_store_create(path, (count, length), np.float32, inputs=rng.integers(0, 256, (count, 16), dtype=np.uint8))
+		store.traces[:] = rng.standard_normal((count, length), dtype=np.float32)
+		store.flush()
+		del store
+
+		workers = 1
+		while workers <= os.cpu_count():
+			start = time.perf_counter()
+			parallel_accumulate(CpaAccumulator(0), path, workers, 2000)
+			report('parallel_accumulate CPA, %d workers' % workers, count, time.perf_counter() - start, 'traces')
+			workers *= 2
+	finally:
+		shutil.rmtree(path)
+
+
+def ttest_two_pass(traces, groups, order):
+	#  reference: all the traces in memory, centered before the powers
+	stats = []
+	for group in (0, 1):
+		x = np.double(traces[groups == group])
+		x = x - np.mean(x, axis=0)
+		if order == 1:
+			x = x + np.mean(np.double(traces[groups == group]), axis=0)
+		elif order >= 3:
+			x = x / np.std(x, axis=0)
+		x = x ** order
+		stats.append((np.mean(x, axis=0), np.var(x, axis=0, ddof=1 if order == 1 else 0), np.shape(x)[0]))
+	(mean_0, var_0, n_0), (mean_1, var_1, n_1) = stats
+	return (mean_0 - mean_1) / np.sqrt(var_0 / n_0 + var_1 / n_1)
+
+
+def bench_higher_order_ttest():
+	#  streaming t-test of order 1..4 on float32 traces with a large DC level,
+	#  accuracy against the two-pass reference
+	count, length, chunk = 100000, 1000, 10000
+	rng = np.random.default_rng(0)
+	traces = np.float32(rng.standard_normal((count, length)) + 1000)
+	groups = rng.integers(0, 2, count)
+	for order in (1, 2, 3, 4):
+		acc = TtestAccumulator(order=order)
+		start = time.perf_counter()
+		for line in range(0, count, chunk):
+			acc.update(traces[line:line + chunk], groups[line:line + chunk])
+		seconds = time.perf_counter() - start
+		error = np.max(np.abs(acc.ttest() - ttest_two_pass(traces, groups, order)))
+		report('TtestAccumulator order %d (max |dt| %.1e)' % (order, error), count, seconds, 'traces')
+
+
+def bench_align_traces():
+	#  1000 jittered float32 traces of 100k samples, static alignment on a
+	#  1000-sample window with +-200 samples of search
+	count, length = 1000, 100000
+	rng = np.random.default_rng(0)
+	base = np.float32(np.cumsum(rng.standard_normal(length + 400)))
+	shifts = rng.integers(-200, 201, count)
+	traces = np.stack([base[200 + shift:200 + shift + length] for shift in shifts])
+	workers = 1
+	while workers <= os.cpu_count():
+		report('align_traces, %d threads' % workers, count, best_of(
+			lambda: align_traces(traces, base[200:200 + length], (40000, 41000), 200, workers=workers), 1, 3), 'traces')
+		workers *= 2
+
+
+def bench_simulated_campaign(count):
+	#  a simulated int8 store of the first round (AddRoundKey and SubBytes,
+	#  4 samples per byte, clock jitter), then the streaming attacks on it
+	path = tempfile.mkdtemp()
+	try:
+		start = time.perf_counter()
+		simulate_store(path, count, range(16), states=[1, 2], pulse=(4, 3, 1, 0), noise=4.0, jitter=1, dtype=np.int8)
+		report('simulate_store, 2 states x 16 bytes', count, time.perf_counter() - start, 'traces')
+
+		start = time.perf_counter()
+		accumulate(CpaAccumulator(range(16)), trace_chunks(path)).correlation()
+		report('CpaAccumulator, 16 key bytes', count, time.perf_counter() - start, 'traces')
+
+		start = time.perf_counter()
+		accumulate(SnrAccumulator(256, lambda inputs: inputs[:, 0]), trace_chunks(path)).snr()
+		report('SnrAccumulator, 256 classes', count, time.perf_counter() - start, 'traces')
+
+		start = time.perf_counter()
+		accumulate(RegressionAccumulator(lambda inputs: aes_crypt_partial(inputs, range(16), 1, 'B1')[:, 0]), trace_chunks(path)).coefficients()
+		report('RegressionAccumulator, 8 bits', count, time.perf_counter() - start, 'traces')
+	finally:
+		shutil.rmtree(path)
+
+
+def bench_template_attack():
+	#  templates of the round 1 S-box output of byte 3 on 20 points of
+	#  interest, then the attack on simulated chunks held in memory
+	key = np.arange(16, dtype=np.uint8)
+	options = {'states': [1, 2], 'pulse': (1.0, 0.5), 'noise': 2.0}
+	samples = simulated_samples([1, 2], pulse=options['pulse'])
+	poi = np.concatenate([samples[:, 3], samples[:, 3] + 1, samples[0, 4:12], samples[1, 4:12]])
+
+	def label(inputs):
+		return aes_crypt_partial(inputs, key, 1, 'B1')[:, 3]
+
+	chunks = list(simulate_chunks(100000, key, 10000, seed=1, **options))
+	start = time.perf_counter()
+	templates = accumulate(TemplateAccumulator(256, label, Projection(poi)), chunks).templates()
+	report('TemplateAccumulator, %d points of interest' % np.size(poi), 100000, time.perf_counter() - start, 'traces')
+
+	chunks = list(simulate_chunks(100000, key, 10000, seed=2, **options))
+	start = time.perf_counter()
+	accumulate(TemplateAttack(templates, 3), chunks).rank(key[3])
+	report('TemplateAttack, 256 guesses', 100000, time.perf_counter() - start, 'traces')
+
+
+def main():
+	#  python benchmark.py [number of simulated traces]
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	bench_aes_sbox()
+	bench_hypothesis()
+	bench_bit_count()
+	bench_parallel_cpa()
+	bench_higher_order_ttest()
+	bench_align_traces()
+	bench_template_attack()
+	bench_simulated_campaign(count)
+
+
+if __name__ == '__main__':
+	main()
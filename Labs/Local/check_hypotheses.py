@@ -0,0 +1,94 @@
+import os
+import sys
+import numpy as np
+
+#  make aes_lib / attack_lib from the Labs folder importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aes_lib import aes_crypt_8bit_and_leak, aes_crypt_partial, aes_guessed_key_byte, aes_key_expansion, aes_state_guesses, AES_INV_SHIFT_ROWS, AES_SHIFT_ROWS
+from attack_lib import hd_hypothesis, hd_mixcolumn_hypothesis
+from hamming_weight import bit_count
+
+
+#  Checks the guess builders of aes_lib and the hypothesis builders of
+#  attack_lib against aes_crypt_partial and the state and mixcolumn_leak
+#  outputs of aes_crypt_8bit_and_leak: under the true key, every builder
+#  must predict exactly the byte or the leak of every state register.
+
+
+def check(name, passed):
+	print('{:<48s} {}'.format(name, 'ok' if passed else 'FAILED'))
+	return passed
+
+
+def check_aes_state_guesses(inputs, key):
+	outputs = aes_crypt_partial(inputs, key, 1, 'C')
+	last_key = aes_key_expansion(key)[10]
+	passed = True
+	for state in ['P', 'K0', 'B1', 'R1', 'K9', 'B10', 'R10', 'C']:
+		first_round = state in ['P', 'K0', 'B1', 'R1']
+		data, round_key = (inputs, key) if first_round else (outputs, last_key)
+		expected = aes_crypt_partial(data, key, 1 if first_round else 0, state)
+		matches = 0
+		for byte in range(16):
+			key_byte = aes_guessed_key_byte(state, byte)
+			guess = 0 if key_byte is None else round_key[key_byte]
+			matches += np.array_equal(aes_state_guesses(data, state, byte)[:, guess], expected[:, byte])
+		passed &= check('aes_state_guesses(%s), 16 bytes' % state, matches == 16)
+	return passed
+
+
+def check_hd_hypothesis(inputs, key):
+	outputs, state, _, _ = aes_crypt_8bit_and_leak(inputs, key, 1)
+	last_key = aes_key_expansion(key)[10]
+	passed = True
+	for first, second in [(0, 2), (1, 2), (37, 38), (37, 40), (38, 40)]:
+		matches = 0
+		for register in range(16):
+			#  the key byte whose value sits in the register
+			if {first, second} & {37, 38}:
+				key_byte = AES_INV_SHIFT_ROWS[register]
+			else:
+				key_byte = register
+			data, guess = (inputs, key[key_byte]) if first < 10 else (outputs, last_key[key_byte])
+			leak = bit_count(np.bitwise_xor(state[first][:, register], state[second][:, register]))
+			matches += np.array_equal(hd_hypothesis(data, key_byte, first, second)[:, guess], leak)
+		passed &= check('hd_hypothesis(%d, %d), 16 registers' % (first, second), matches == 16)
+
+	#  across AddRoundKey the distance is a constant HW(K); the others
+	#  depend on two key bytes
+	for first, second in [(0, 1), (39, 40), (2, 3), (0, 3), (38, 39), (37, 39)]:
+		try:
+			hd_hypothesis(inputs, 4, first, second)
+			refused = False
+		except ValueError:
+			refused = True
+		passed &= check('hd_hypothesis(%d, %d) refused' % (first, second), refused)
+	return passed
+
+
+def check_hd_mixcolumn_hypothesis(inputs, key):
+	_, _, _, mixcolumn_leak = aes_crypt_8bit_and_leak(inputs, key, 1)
+	matches = 0
+	for column in range(4):
+		for row in range(4):
+			k1 = int(key[AES_SHIFT_ROWS[4 * column + row]])
+			k2 = int(key[AES_SHIFT_ROWS[4 * column + (row + 1) % 4]])
+			tm, xtime_tm = mixcolumn_leak[0, column, :, 2 * row + 1], mixcolumn_leak[0, column, :, 2 * row + 2]
+			leak = bit_count(np.bitwise_xor(np.uint8(tm), np.uint8(xtime_tm)))
+			matches += np.array_equal(hd_mixcolumn_hypothesis(inputs, column, row)[:, k1 * 256 + k2], leak)
+	return check('hd_mixcolumn_hypothesis, 16 pairs', matches == 16)
+
+
+def main():
+	rng = np.random.default_rng(0)
+	inputs = rng.integers(0, 256, (500, 16), dtype=np.uint8)
+	key = rng.integers(0, 256, 16, dtype=np.uint8)
+	passed = check_aes_state_guesses(inputs, key)
+	passed &= check_hd_hypothesis(inputs, key)
+	passed &= check_hd_mixcolumn_hypothesis(inputs, key)
+	if not passed:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,72 @@
+import os
+import sys
+import tempfile
+import numpy as np
+import scipy.signal
+
+#  make preprocess_lib from the Labs folder importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from preprocess_lib import decimate_traces, integrate_traces, resample_traces, transform_store
+from trace_lib import trace_store_create
+
+
+#  Checks the preprocessing stages of preprocess_lib against their
+#  reference implementations and on degenerate inputs.
+
+
+def check(name, passed):
+	print('{:<48s} {}'.format(name, 'ok' if passed else 'FAILED'))
+	return passed
+
+
+def check_resample_traces(rng):
+	passed = True
+	#  even and odd lengths, shrinking and growing
+	for length, samples in [(1000, 400), (1000, 401), (1001, 400), (1001, 401), (1000, 1500), (1000, 1001),
+			(1001, 1500), (1001, 1000), (1000, 1000)]:
+		traces = rng.standard_normal((8, length))
+		error = np.max(np.abs(resample_traces(traces, samples) - scipy.signal.resample(traces, samples, axis=1)))
+		passed &= check('resample_traces %d -> %d' % (length, samples), error < 1e-12)
+	return passed
+
+
+def check_integrate_traces():
+	passed = True
+	for mode in ['sum', 'abs', 'peak']:
+		result = integrate_traces(np.ones((3, 10), dtype=np.int8), 12.5, mode)
+		passed &= check('integrate_traces %s, no full window' % mode, np.shape(result) == (3, 0))
+	return passed
+
+
+def check_transform_store(rng):
+	passed = True
+	with tempfile.TemporaryDirectory() as folder:
+		traces = rng.integers(-128, 128, (50, 1000), dtype=np.int8)
+		source = trace_store_create(os.path.join(folder, 'source'), np.shape(traces), np.int8, {'rate': 500e6},
+			inputs=np.zeros((50, 16), dtype=np.uint8))
+		source.traces[:] = traces
+		source.flush()
+		for function, args, rate in [(decimate_traces, (10,), 50e6), (integrate_traces, (12.5,), 40e6),
+				(resample_traces, (400,), 200e6)]:
+			store = transform_store(source, os.path.join(folder, function.__name__), function, *args, chunk_size=16)
+			passed &= check('transform_store %s' % function.__name__,
+				np.array_equal(store.traces, function(traces, *args)) and store.sampling['rate'] == rate)
+
+		empty = trace_store_create(os.path.join(folder, 'empty'), (0, 1000), np.int8, {'rate': 500e6})
+		empty.flush()
+		store = transform_store(empty, os.path.join(folder, 'empty_dec10'), decimate_traces, 10)
+		passed &= check('transform_store, empty source', store.shape == (0, 100) and store.sampling['rate'] == 50e6)
+	return passed
+
+
+def main():
+	rng = np.random.default_rng(0)
+	passed = check_resample_traces(rng)
+	passed &= check_integrate_traces()
+	passed &= check_transform_store(rng)
+	if not passed:
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
@@ -1,3 +1,4 @@
+import functools
 import numpy as np
 import math
 
@@ -56,6 +57,11 @@ def aes_xtimes(input_data):
 
 	return result
 
+
+#  aes_xtimes of every byte value
+AES_XTIME = np.uint8(aes_xtimes(np.arange(256)))
+AES_XTIME.setflags(write=False)
+
 # function [result] = aes_shift_rows(input_data, encrypt)
 
 #  performs the AES ShiftRows Transformation
@@ -150,6 +156,9 @@ def aes_shift_rows(input_data, encrypt):
 #  - encrypt: Paramter indicating whether an encryption or a decryption is performed
 # 			    (1=encryption, 0=decryption) In the case of a decryption, the inverse ByteSub
 #             operation is performed.
+#  - out    : Optional np.uint8 array of the size of 'data' that receives the result.
+# 
+#  Values of 'data' outside 0..255 raise a ValueError, with or without 'out'.
 # 
 #  RETURNVALUES:
 # 
@@ -166,94 +175,106 @@ def aes_shift_rows(input_data, encrypt):
 #  CREATION_DATE: 31 July 2001
 #  LAST_REVISION: 10 March 2009
 
-#  the sbox and inverse sbox tables
-
-
-def aes_sbox(input_data, encrypt):
-
-	original_sbox = np.uint8([
-		99,  124, 119, 123, 242, 107, 111, 197,
-		48,    1, 103,  43, 254, 215, 171, 118,
-		202, 130, 201, 125, 250,  89,  71, 240,
-		173, 212, 162, 175, 156, 164, 114, 192,
-		183, 253, 147,  38,  54,  63, 247, 204,
-		52,  165, 229, 241, 113, 216,  49,  21,
-		4,   199,  35, 195,  24, 150,   5, 154,
-		7,    18, 128, 226, 235,  39, 178, 117,
-		9,   131,  44,  26,  27, 110,  90, 160,
-		82,   59, 214, 179,  41, 227,  47, 132,
-		83,  209,   0, 237,  32, 252, 177,  91,
-		106, 203, 190,  57,  74,  76,  88, 207,
-		208, 239, 170, 251,  67,  77,  51, 133,
-		69,  249,   2, 127,  80,  60, 159, 168,
-		81,  163,  64, 143, 146, 157,  56, 245,
-		188, 182, 218,  33,  16, 255, 243, 210,
-		205,  12,  19, 236,  95, 151,  68,  23,
-		196, 167, 126,  61, 100,  93,  25, 115,
-		96,  129,  79, 220,  34,  42, 144, 136,
-		70,  238, 184,  20, 222,  94,  11, 219,
-		224,  50,  58,  10,  73,   6,  36,  92,
-		194, 211, 172,  98, 145, 149, 228, 121,
-		231, 200,  55, 109, 141, 213,  78, 169,
-		108,  86, 244, 234, 101, 122, 174,   8,
-		186, 120,  37,  46,  28, 166, 180, 198,
-		232, 221, 116,  31,  75, 189, 139, 138,
-		112,  62, 181, 102,  72,   3, 246,  14,
-		97,   53,  87, 185, 134, 193,  29, 158,
-		225, 248, 152,  17, 105, 217, 142, 148,
-		155,  30, 135, 233, 206,  85,  40, 223,
-		140, 161, 137,  13, 191, 230,  66, 104,
-		65,  153,  45,  15, 176,  84, 187, 22])
-
-	# original_sbox = original_sbox';
-
-	inv_sbox = np.uint8([
-		82,   9, 106, 213,  48,  54, 165,  56,
-		191,  64, 163, 158, 129, 243, 215, 251,
-		124, 227,  57, 130, 155,  47, 255, 135,
-		52, 142,  67,  68, 196, 222, 233, 203,
-		84, 123, 148,  50, 166, 194,  35,  61,
-		238,  76, 149,  11,  66, 250, 195,  78,
-		8,  46, 161, 102,  40, 217,  36, 178,
-		118,  91, 162,  73, 109, 139, 209,  37,
-		114, 248, 246, 100, 134, 104, 152,  22,
-		212, 164,  92, 204,  93, 101, 182, 146,
-		108, 112,  72,  80, 253, 237, 185, 218,
-		94,  21,  70,  87, 167, 141, 157, 132,
-		144, 216, 171,   0, 140, 188, 211,  10,
-		247, 228,  88,   5, 184, 179,  69,   6,
-		208,  44,  30, 143, 202,  63,  15,   2,
-		193, 175, 189,   3,   1,  19, 138, 107,
-		58, 145,  17,  65,  79, 103, 220, 234,
-		151, 242, 207, 206, 240, 180, 230, 115,
-		150, 172, 116,  34, 231, 173,  53, 133,
-		226, 249,  55, 232,  28, 117, 223, 110,
-		71, 241,  26, 113,  29,  41, 197, 137,
-		111, 183,  98,  14, 170,  24, 190,  27,
-		252,  86,  62,  75, 198, 210, 121,  32,
-		154, 219, 192, 254, 120, 205,  90, 244,
-		31, 221, 168,  51, 136,   7, 199,  49,
-		177,  18,  16,  89,  39, 128, 236,  95,
-		96,  81, 127, 169,  25, 181,  74,  13,
-		45, 229, 122, 159, 147, 201, 156, 239,
-		160, 224,  59,  77, 174,  42, 245, 176,
-		200, 235, 187,  60, 131,  83, 153,  97,
-		23,  43,   4, 126, 186, 119, 214,  38,
-		225, 105,  20,  99,  85,  33,  12, 125])
-
-	# inv_sbox = inv_sbox';
+#  the sbox and inverse sbox tables, built once at import and read-only
+
+AES_SBOX = np.uint8([
+	99,  124, 119, 123, 242, 107, 111, 197,
+	48,    1, 103,  43, 254, 215, 171, 118,
+	202, 130, 201, 125, 250,  89,  71, 240,
+	173, 212, 162, 175, 156, 164, 114, 192,
+	183, 253, 147,  38,  54,  63, 247, 204,
+	52,  165, 229, 241, 113, 216,  49,  21,
+	4,   199,  35, 195,  24, 150,   5, 154,
+	7,    18, 128, 226, 235,  39, 178, 117,
+	9,   131,  44,  26,  27, 110,  90, 160,
+	82,   59, 214, 179,  41, 227,  47, 132,
+	83,  209,   0, 237,  32, 252, 177,  91,
+	106, 203, 190,  57,  74,  76,  88, 207,
+	208, 239, 170, 251,  67,  77,  51, 133,
+	69,  249,   2, 127,  80,  60, 159, 168,
+	81,  163,  64, 143, 146, 157,  56, 245,
+	188, 182, 218,  33,  16, 255, 243, 210,
+	205,  12,  19, 236,  95, 151,  68,  23,
+	196, 167, 126,  61, 100,  93,  25, 115,
+	96,  129,  79, 220,  34,  42, 144, 136,
+	70,  238, 184,  20, 222,  94,  11, 219,
+	224,  50,  58,  10,  73,   6,  36,  92,
+	194, 211, 172,  98, 145, 149, 228, 121,
+	231, 200,  55, 109, 141, 213,  78, 169,
+	108,  86, 244, 234, 101, 122, 174,   8,
+	186, 120,  37,  46,  28, 166, 180, 198,
+	232, 221, 116,  31,  75, 189, 139, 138,
+	112,  62, 181, 102,  72,   3, 246,  14,
+	97,   53,  87, 185, 134, 193,  29, 158,
+	225, 248, 152,  17, 105, 217, 142, 148,
+	155,  30, 135, 233, 206,  85,  40, 223,
+	140, 161, 137,  13, 191, 230,  66, 104,
+	65,  153,  45,  15, 176,  84, 187, 22])
+AES_SBOX.setflags(write=False)
+
+AES_INV_SBOX = np.uint8([
+	82,   9, 106, 213,  48,  54, 165,  56,
+	191,  64, 163, 158, 129, 243, 215, 251,
+	124, 227,  57, 130, 155,  47, 255, 135,
+	52, 142,  67,  68, 196, 222, 233, 203,
+	84, 123, 148,  50, 166, 194,  35,  61,
+	238,  76, 149,  11,  66, 250, 195,  78,
+	8,  46, 161, 102,  40, 217,  36, 178,
+	118,  91, 162,  73, 109, 139, 209,  37,
+	114, 248, 246, 100, 134, 104, 152,  22,
+	212, 164,  92, 204,  93, 101, 182, 146,
+	108, 112,  72,  80, 253, 237, 185, 218,
+	94,  21,  70,  87, 167, 141, 157, 132,
+	144, 216, 171,   0, 140, 188, 211,  10,
+	247, 228,  88,   5, 184, 179,  69,   6,
+	208,  44,  30, 143, 202,  63,  15,   2,
+	193, 175, 189,   3,   1,  19, 138, 107,
+	58, 145,  17,  65,  79, 103, 220, 234,
+	151, 242, 207, 206, 240, 180, 230, 115,
+	150, 172, 116,  34, 231, 173,  53, 133,
+	226, 249,  55, 232,  28, 117, 223, 110,
+	71, 241,  26, 113,  29,  41, 197, 137,
+	111, 183,  98,  14, 170,  24, 190,  27,
+	252,  86,  62,  75, 198, 210, 121,  32,
+	154, 219, 192, 254, 120, 205,  90, 244,
+	31, 221, 168,  51, 136,   7, 199,  49,
+	177,  18,  16,  89,  39, 128, 236,  95,
+	96,  81, 127, 169,  25, 181,  74,  13,
+	45, 229, 122, 159, 147, 201, 156, 239,
+	160, 224,  59,  77, 174,  42, 245, 176,
+	200, 235, 187,  60, 131,  83, 153,  97,
+	23,  43,   4, 126, 186, 119, 214,  38,
+	225, 105,  20,  99,  85,  33,  12, 125])
+AES_INV_SBOX.setflags(write=False)
+
+#  derived tables for building power model hypotheses:
+#  AES_SBOX_BITS[x, b] is bit b (0 = LSB) of Sbox(x), AES_SBOX_HW[x] is the
+#  Hamming weight of Sbox(x)
+AES_SBOX_BITS = np.uint8((AES_SBOX[:, np.newaxis] >> np.arange(8)) & 1)
+AES_SBOX_BITS.setflags(write=False)
+AES_SBOX_HW = np.uint8(np.sum(AES_SBOX_BITS, axis=1))
+AES_SBOX_HW.setflags(write=False)
+
+
+def aes_sbox(input_data, encrypt, out=None):
 
 	if encrypt == 0:
-
-		result = inv_sbox[np.array(input_data)]
-
+		table = AES_INV_SBOX
 	else:
+		table = AES_SBOX
 
-		result = original_sbox[np.array(input_data)]
+	input_data = np.asarray(input_data)
+	#  uint8 data cannot be out of range, other types are checked once
+	if input_data.dtype != np.uint8 and np.size(input_data) and (np.min(input_data) < 0 or np.max(input_data) > 255):
+		raise ValueError('the S-box inputs must be bytes (0..255)')
 
-	# if np.shape(input_data)[0] == 1:
-		# return result
-		# result = np.transpose(result)
+	if out is None:
+		result = table[input_data]
+	else:
+		#  write into a preallocated buffer, no allocation in hot loops; the
+		#  indices are checked bytes, and only a non-raising mode writes
+		#  'out' directly
+		result = table.take(input_data, out=out, mode='wrap')
 	return result
 
 # function [result] = aes_round_key(key, round)
@@ -288,22 +309,157 @@ def aes_sbox(input_data, encrypt):
 
 
 def aes_round_key(key, round):
-	rcon = 1
 
-	result = np.copy(key)
-	next = np.copy(key)
-	for i in range(round + 1):
-		next[0, 0:4] = aes_sbox([result[0, 13], result[0, 14], result[0, 15], result[0, 12]], 1)
-		next[0, 0:4] = np.bitwise_xor(next[0, 0:4], result[0, 0:4])
-		next[0, 0] = np.bitwise_xor(next[0, 0], rcon)
+	#  the whole schedule is expanded once per key and cached, see
+	#  aes_key_expansion
+	result = np.copy(aes_key_expansion(key)[round + 1:round + 2, :])
+	return result
 
-		next[0, 4:8] = np.bitwise_xor(next[0, 0: 4], result[0, 4: 8])
-		next[0, 8:12] = np.bitwise_xor(next[0, 4: 8], result[0, 8:12])
-		next[0, 12:16] = np.bitwise_xor(next[0, 8:12], result[0, 12:16])
+# function [result] = aes_key_expansion(key)
 
-		result = np.copy(next)
-		rcon = aes_xtimes(rcon)
-	
+#  calculates all round keys of AES-128 in a single pass
+#
+#  DESCRIPTION:
+#
+#  aes_key_expansion(key)
+#
+#  expands the 128-bit secret key 'key' into the 11 round keys used by
+#  AES-128. The schedules of the AES_KEY_CACHE_SIZE most recently used keys
+#  are kept in an LRU cache keyed on the key bytes, so encrypting many
+#  batches under the same key expands it only once.
+#
+#  PARAMETERS:
+#
+#  - key: A vector of 16 bytes representing the secret key.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A read-only np.uint8 matrix of size 11 x 16. Line 0 is the secret key
+#    itself, line i is the key added after round i, so line i equals
+#    aes_round_key(key, i - 1).
+#
+#  EXAMPLE:
+#
+#  aes_key_expansion([1, 2,3 ,4, 5, 6 ,7 ,8, 1, 2,3 ,4, 5, 6 ,7 ,8])
+
+AES_KEY_CACHE_SIZE = 64
+
+#  _AES_RCON[i] is the round constant used to derive round key i from i - 1
+_AES_RCON = [0, 1]
+for _ in range(9):
+	_AES_RCON.append(aes_xtimes(_AES_RCON[-1]))
+_AES_RCON = np.uint8(_AES_RCON)
+
+
+def _aes_key_expansion_batch(keys):
+	#  keys is an M x 16 matrix, the result holds one schedule per line as an
+	#  11 x M x 16 array so that result[i] are the M keys of round i
+	result = np.zeros([11, np.shape(keys)[0], 16], dtype=np.uint8)
+	result[0] = keys
+
+	for i in range(1, 11):
+		prev = result[i - 1]
+		#  RotWord + SubWord + Rcon on the last word of the previous key
+		result[i, :, 0:4] = np.bitwise_xor(aes_sbox(prev[:, [13, 14, 15, 12]], 1), prev[:, 0:4])
+		result[i, :, 0] ^= _AES_RCON[i]
+		for w in range(4, 16, 4):
+			result[i, :, w:w + 4] = np.bitwise_xor(result[i, :, w - 4:w], prev[:, w:w + 4])
+	return result
+
+
+@functools.lru_cache(maxsize=AES_KEY_CACHE_SIZE)
+def _aes_key_expansion_cached(key_bytes):
+	key = np.frombuffer(key_bytes, dtype=np.uint8)
+	result = _aes_key_expansion_batch(np.reshape(key, (1, 16)))[:, 0, :]
+	result.setflags(write=False)
+	return result
+
+
+def aes_key_expansion(key):
+	key_bytes = np.uint8(np.reshape(np.asarray(key), 16)).tobytes()
+	return _aes_key_expansion_cached(key_bytes)
+
+# function [result] = aes_inverse_key_expansion(round_key, round)
+
+#  recovers the 128-bit secret key from the round key of any round
+#
+#  DESCRIPTION:
+#
+#  aes_inverse_key_expansion(round_key, round)
+#
+#  runs the AES-128 key schedule backwards from round 'round' to round 0
+#  for every line of 'round_key' at once. This is how a last-round attack
+#  turns a recovered (or enumerated) round key 10 into the secret key.
+#
+#  PARAMETERS:
+#
+#  - round_key:
+#    A matrix of bytes of size M x 16, each line is a candidate round key.
+#  - round:
+#    The round the keys belong to, numbered as the lines of
+#    aes_key_expansion (0 = secret key, 10 = last round key). The output
+#    of aes_round_key(key, i) is the key of round i + 1.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A np.uint8 matrix of size M x 16 holding the corresponding secret keys.
+#
+#  EXAMPLE:
+#
+#  aes_inverse_key_expansion(aes_key_expansion(range(16))[10], 10)
+
+
+def aes_inverse_key_expansion(round_key, round):
+	result = np.uint8(np.reshape(np.asarray(round_key), (-1, 16)))
+
+	for i in range(round, 0, -1):
+		prev = np.empty(np.shape(result), dtype=np.uint8)
+		#  words 1..3 of the previous key are the XOR of adjacent words
+		for w in range(4, 16, 4):
+			prev[:, w:w + 4] = np.bitwise_xor(result[:, w:w + 4], result[:, w - 4:w])
+		prev[:, 0:4] = np.bitwise_xor(aes_sbox(prev[:, [13, 14, 15, 12]], 1), result[:, 0:4])
+		prev[:, 0] ^= _AES_RCON[i]
+		result = prev
+	return result
+
+# function [result] = aes_verify_keys(keys, plaintext, ciphertext)
+
+#  checks which candidate keys map a known plaintext to a known ciphertext
+#
+#  DESCRIPTION:
+#
+#  aes_verify_keys(keys, plaintext, ciphertext)
+#
+#  encrypts 'plaintext' under every line of 'keys' with aes_crypt_batch
+#  and compares the results with 'ciphertext'.
+#
+#  PARAMETERS:
+#
+#  - keys:
+#    A matrix of bytes of size M x 16, each line is a candidate secret key.
+#  - plaintext, ciphertext:
+#    Vectors of 16 bytes, a known plaintext / ciphertext pair.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A boolean vector of length M, True where the key is consistent with
+#    the pair.
+#
+#  EXAMPLE:
+#
+#  aes_verify_keys(aes_inverse_key_expansion(candidates, 10), p, c)
+
+
+def aes_verify_keys(keys, plaintext, ciphertext):
+	keys = np.uint8(np.reshape(np.asarray(keys), (-1, 16)))
+	plaintext = np.uint8(np.reshape(np.asarray(plaintext), (1, 16)))
+	ciphertext = np.uint8(np.reshape(np.asarray(ciphertext), (1, 16)))
+
+	data = np.repeat(plaintext, np.shape(keys)[0], axis=0)
+	result = np.all(aes_crypt_batch(data, keys, 1) == ciphertext, axis=1)
 	return result
 
 # function [result] = aes_mult(input_data, constant)
@@ -677,7 +833,7 @@ def aes_mix_columns_8bit_and_leak(input_data, encrypt):
 			tmp = np.bitwise_xor(np.bitwise_xor(np.bitwise_xor(
 			data[:, 0 + 4 * i], data[:, 1 + 4 * i]),
 			data[:, 2 + 4 * i]), data[:, 3 + 4 * i])  # Leak  # 0.1
-			leak[i + 0, :, 0] = tmp[0]
+			leak[i + 0, :, 0] = tmp
 
 			tm = np.bitwise_xor(data[:, 0 + 4 * i], data[:, 1 + 4 * i])  # Leak  # 1.1
 			leak[i + 0, :, 1] = tm
@@ -757,14 +913,11 @@ import numpy as np
 # LAST_REVISION: 27 October 2008
 
 def aes_add_round_key(key, data):
-	key_len = np.shape(key)[1]
-
-	result = np.uint8(np.zeros(np.size(data)))
-	key = np.asmatrix(key)
-	# do add_roundkey column by colomn
-	for i in range(key_len):
-		# print(key[0, i], data[0, i])
-		result[i] = np.bitwise_xor(key[0, i], data[0, i])
+	key = np.uint8(np.reshape(key, (1, -1)))
+	data = np.uint8(np.reshape(data, (-1, np.shape(key)[1])))
+
+	# the key row is broadcast over every line of 'data'
+	result = np.bitwise_xor(key, data)
 	return np.asmatrix(result)
 
 # function result = aes_crypt(input_data, secret_key, encrypt)
@@ -809,35 +962,8 @@ def aes_add_round_key(key, data):
 
 def aes_crypt(input_data, secret_key, encrypt):
 
-	if encrypt == 0:
-
-		for i in range(9, -1, -1):
-			input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
-
-			if i != 9:
-				input_data = aes_mix_columns(input_data, 0)
-
-			input_data = aes_shift_rows(input_data, 0)
-
-			input_data = np.uint8(aes_sbox(input_data, 0))
-
-		input_data = aes_add_round_key(secret_key, input_data)
-
-	else:
-
-		input_data = aes_add_round_key(secret_key, input_data)
-
-		for i in range(10):
-			input_data = np.uint8(aes_sbox(input_data, 1))
-
-			input_data = aes_shift_rows(input_data, 1)
-
-			if i != 9:
-				input_data = aes_mix_columns(input_data, 1)
-
-			input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
-
-	result = input_data
+	#  all lines are en/decrypted at once by the table-driven engine
+	result = np.asmatrix(aes_crypt_batch(input_data, secret_key, encrypt))
 	return result
 
 # function result = aes_crypt_8bit(input_data, secret_key, encrypt)
@@ -883,33 +1009,10 @@ def aes_crypt(input_data, secret_key, encrypt):
 
 def aes_crypt_8bit(input_data, secret_key, encrypt):
 
-	if encrypt == 0:
-
-		for i in range(9, -1, -1):
-			input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
-
-			if i != 9:
-				input_data = aes_mix_columns_8bit(input_data, 0)
-
-			input_data = aes_shift_rows(input_data, 0)
-
-			input_data = np.uint8(aes_sbox(input_data, 0))
-
-		input_data = aes_add_round_key(secret_key, input_data)
-
-	else:
-
-		input_data = aes_add_round_key(secret_key, input_data)
-		for i in range(10):
-			input_data = np.uint8(aes_sbox(input_data, 1))
-
-			input_data = aes_shift_rows(input_data, 1)
-
-			if i != 9:
-				input_data = aes_mix_columns_8bit(input_data, 1)
-			input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
-
-	result = input_data
+	#  the 8-bit MixColumns only changes the leakage, not the result, so the
+	#  table-driven engine is bit-exact here as well (see
+	#  aes_crypt_8bit_and_leak for the step-by-step 8-bit version)
+	result = np.asmatrix(aes_crypt_batch(input_data, secret_key, encrypt))
 	return result
 
 # function [result state rkeys mixcolumn_leak]= aes_crypt_8bit_and_leak(input_data, secret_key, encrypt)
@@ -978,24 +1081,23 @@ def aes_crypt_8bit_and_leak(input_data, secret_key, encrypt):
 	else:  # encryption
 		mixcolumn_leak = np.zeros([9, 4, np.shape(input_data)[0], 9])
 	
-	for round in range(10):
-		rkeys[round, :] = aes_round_key(secret_key, round)
-	
 	#  expand the keys
+	round_keys = aes_key_expansion(secret_key)
+	rkeys[:, :] = round_keys[1:, :]
 	
 	if encrypt == 0:  # decryption
 		state[40, :] = input_data
 	
 		for i in range(9, -1, -1):
 			if i != 9:
-				input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
+				input_data = aes_add_round_key(round_keys[i + 1], input_data)
 				state[2 + i*4 + 2, :] = input_data
 	
 				[input_data, leak] = aes_mix_columns_8bit_and_leak(input_data, 0)
 				mixcolumn_leak[i, :, :, :] = leak
 				state[2 + i*4 + 1, :] = input_data
 			else:
-				input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
+				input_data = aes_add_round_key(round_keys[i + 1], input_data)
 				state[2 + i*4 + 1, :] = input_data
 	
 			input_data = aes_shift_rows(input_data, 0)
@@ -1026,11 +1128,486 @@ def aes_crypt_8bit_and_leak(input_data, secret_key, encrypt):
 
 				state[2 + i*4 + 2, :] = np.copy(input_data)
 	
-				input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
+				input_data = aes_add_round_key(round_keys[i + 1], input_data)
 				state[2 + i*4 + 3, :] = np.copy(input_data)
 			else:
-				input_data = aes_add_round_key(aes_round_key(secret_key, i), input_data)
+				input_data = aes_add_round_key(round_keys[i + 1], input_data)
 				state[2 + i*4 + 2, :] = np.copy(input_data)
 
 	result = np.copy(input_data)
 	return result, state, rkeys, mixcolumn_leak
+
+# function result = aes_crypt_batch(input_data, secret_key, encrypt)
+
+#  performs AES-128 encryptions or decryptions of many blocks at once
+#
+#  DESCRIPTION:
+#
+#  aes_crypt_batch(input_data, secret_key, encrypt)
+#
+#  Table-driven version of aes_crypt. SubBytes, ShiftRows and MixColumns
+#  are merged into four 256-entry 32-bit tables (one per state row), built
+#  once at import from aes_sbox / aes_mult, so every round costs 16 table
+#  lookups per block. All lines of 'input_data' are processed together
+#  through numpy fancy indexing, in chunks of AES_BATCH_CHUNK lines so
+#  that the working set stays in the CPU cache.
+#
+#  PARAMETERS:
+#
+#  - input_data:
+#    A matrix of bytes of size N x 16, each line is one 128-bit block.
+#  - secret_key:
+#    A vector of 16 bytes that represents the secret key, or a matrix of
+#    N x 16 bytes holding a separate key for every line of 'input_data'.
+#  - encrypt:
+#    Paramter indicating whether an encryption or a decryption is performed
+#    (1=encryption, 0=decryption).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A np.uint8 array of size N x 16 holding the en/decrypted blocks.
+#
+#  EXAMPLE:
+#
+#  result = aes_crypt_batch(np.random.randint(0, 256, (1000, 16)), range(16), 1)
+
+AES_BATCH_CHUNK = 16384
+
+#  byte j of the state after ShiftRows is byte AES_SHIFT_ROWS[j] before it
+AES_SHIFT_ROWS = np.array([(j + 4 * (j % 4)) % 16 for j in range(16)])
+AES_INV_SHIFT_ROWS = np.array([(j - 4 * (j % 4)) % 16 for j in range(16)])
+
+
+def _aes_round_tables(sbox, mc_matrix):
+	#  table[row][x] is the MixColumns output column (4 bytes packed into a
+	#  little-endian word) produced by the byte x sitting in 'row'
+	tables = np.zeros([4, 256], dtype=np.uint32)
+	for row in range(4):
+		for out_row in range(4):
+			product = np.uint32(aes_mult(sbox, mc_matrix[out_row][row]))
+			tables[row] |= product << np.uint32(8 * out_row)
+	return tables
+
+
+_ENC_TABLES = _aes_round_tables(
+	np.int64(AES_SBOX), [[2, 3, 1, 1], [1, 2, 3, 1], [1, 1, 2, 3], [3, 1, 1, 2]])
+_DEC_TABLES = _aes_round_tables(
+	np.int64(AES_INV_SBOX), [[14, 11, 13, 9], [9, 14, 11, 13], [13, 9, 14, 11], [11, 13, 9, 14]])
+#  InvMixColumns of a plain byte (identity S-box), for the decryption round keys
+_INV_MC_TABLES = _aes_round_tables(
+	np.arange(256), [[14, 11, 13, 9], [9, 14, 11, 13], [13, 9, 14, 11], [11, 13, 9, 14]])
+
+
+def _aes_mix_words(data, tables, shift, out):
+	#  out[:, c] = XOR over rows of tables[row][data[:, shift[4c + row]]]
+	tmp = np.empty(np.shape(data)[0], dtype=np.uint32)
+	for c in range(4):
+		np.take(tables[0], data[:, shift[4 * c]], out=out[:, c], mode='wrap')
+		for row in range(1, 4):
+			np.take(tables[row], data[:, shift[4 * c + row]], out=tmp, mode='wrap')
+			np.bitwise_xor(out[:, c], tmp, out=out[:, c])
+	return out
+
+
+def _aes_schedule_words(round_keys, encrypt):
+	#  round_keys is 11 x 16 (one key) or 11 x n x 16 (one key per line)
+	result = np.ascontiguousarray(round_keys, dtype=np.uint8).view('<u4')
+	if encrypt == 0:
+		#  equivalent inverse cipher: InvMixColumns is moved onto the round keys
+		result = np.copy(result)
+		inner = np.reshape(round_keys[1:10], (-1, 16))
+		mixed = np.empty([np.shape(inner)[0], 4], dtype=np.uint32)
+		_aes_mix_words(inner, _INV_MC_TABLES, np.arange(16), mixed)
+		result[1:10] = np.reshape(mixed, np.shape(result[1:10]))
+	return result
+
+
+def _aes_crypt_chunk(data, round_keys, key_words, encrypt):
+	n = np.shape(data)[0]
+	words = [np.empty([n, 4], dtype=np.uint32) for _ in range(2)]
+
+	if encrypt == 0:
+		state = np.bitwise_xor(data, round_keys[10])
+		for i in range(9, 0, -1):
+			out = _aes_mix_words(state, _DEC_TABLES, AES_INV_SHIFT_ROWS, words[i % 2])
+			np.bitwise_xor(out, key_words[i], out=out)
+			state = out.view(np.uint8)
+		result = np.bitwise_xor(AES_INV_SBOX[state[:, AES_INV_SHIFT_ROWS]], round_keys[0])
+	else:
+		state = np.bitwise_xor(data, round_keys[0])
+		for i in range(1, 10):
+			out = _aes_mix_words(state, _ENC_TABLES, AES_SHIFT_ROWS, words[i % 2])
+			np.bitwise_xor(out, key_words[i], out=out)
+			state = out.view(np.uint8)
+		result = np.bitwise_xor(AES_SBOX[state[:, AES_SHIFT_ROWS]], round_keys[10])
+	return result
+
+
+def aes_crypt_batch(input_data, secret_key, encrypt):
+	data = np.uint8(np.reshape(np.asarray(input_data), (-1, 16)))
+	keys = np.uint8(np.reshape(np.asarray(secret_key), (-1, 16)))
+	per_line_keys = np.shape(keys)[0] > 1
+
+	if not per_line_keys:
+		round_keys = aes_key_expansion(keys)
+		key_words = _aes_schedule_words(round_keys, encrypt)
+
+	result = np.empty(np.shape(data), dtype=np.uint8)
+	for start in range(0, np.shape(data)[0], AES_BATCH_CHUNK):
+		stop = start + AES_BATCH_CHUNK
+		if per_line_keys:
+			round_keys = _aes_key_expansion_batch(keys[start:stop])
+			key_words = _aes_schedule_words(round_keys, encrypt)
+		result[start:stop] = _aes_crypt_chunk(data[start:stop], round_keys, key_words, encrypt)
+	return result
+
+# function index = aes_state_index(name)
+
+#  the position of a named intermediate in the state progression
+#
+#  DESCRIPTION:
+#
+#  aes_state_index(name)
+#
+#  translates the legend of aes_crypt_8bit_and_leak into the index of the
+#  41 recorded states:
+#    P K BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRK(=C)
+#  'P' is the plaintext, 'K0' the state after the first AddRoundKey, and
+#  'B<r>', 'R<r>', 'M<r>', 'K<r>' the states after SubBytes, ShiftRows,
+#  MixColumns and AddRoundKey of round r (1..10); 'C' (= 'K10') is the
+#  ciphertext. An index 0..40 is returned as it is.
+#
+#  EXAMPLE:
+#
+#  aes_state_index('B1')   # 2, the round 1 S-box outputs
+
+_AES_STATE_OPERATIONS = {'B': 2, 'R': 3, 'M': 4, 'K': 5}
+
+
+def aes_state_index(name):
+	if isinstance(name, (int, np.integer)):
+		index = int(name)
+	elif name == 'P':
+		index = 0
+	elif name in ('C', 'K10'):
+		index = 40
+	elif name == 'K0':
+		index = 1
+	else:
+		operation, round = name[:1], int(name[1:]) if name[1:].isdigit() else 0
+		if operation not in _AES_STATE_OPERATIONS or not 1 <= round <= (9 if operation in 'MK' else 10):
+			raise ValueError('unknown AES state %s' % name)
+		index = _AES_STATE_OPERATIONS[operation] + 4 * (round - 1)
+	if not 0 <= index <= 40:
+		raise ValueError('AES state index %d is not in 0..40' % index)
+	return index
+
+# function records = aes_crypt_8bit_record(input_data, secret_key, encrypt, record)
+
+#  records selected intermediates of AES-128 en/decryptions
+#
+#  DESCRIPTION:
+#
+#  records = aes_crypt_8bit_record(input_data, secret_key, encrypt, record)
+#
+#  Selective version of aes_crypt_8bit_and_leak: only the intermediates
+#  named in 'record' are kept, each in its own np.uint8 matrix, instead of
+#  the 41 x N x 16 state and the float64 MixColumns leak. The cipher runs
+#  on all lines at once, in chunks of AES_BATCH_CHUNK lines, and stops as
+#  soon as the last requested intermediate is reached (for a decryption,
+#  the cipher runs backwards from state 40 and stops at the earliest
+#  one). One byte of 10^7 traces is thus recorded in 10 MB.
+#
+#  PARAMETERS:
+#
+#  - input_data:
+#    A matrix of bytes of size N x 16, the plaintexts (encryption) or the
+#    ciphertexts (decryption).
+#  - secret_key:
+#    A vector of 16 bytes that represents the secret key.
+#  - encrypt:
+#    Paramter indicating whether an encryption or a decryption is performed
+#    (1=encryption, 0=decryption).
+#  - record:
+#    A dictionary from the intermediates to record to the bytes kept of
+#    each (None for all 16), or a list of intermediates. An intermediate is
+#    a state, by name or index as for aes_state_index, or 'MC<r>', the
+#    values leaked by the 8-bit MixColumns of round r (1..9); for those
+#    the selection is of the columns (0..3).
+#
+#  RETURNVALUES:
+#
+#  - records:
+#    A dictionary with, for every key of 'record', a matrix of bytes of
+#    size N x |bytes| for a state, or N x |columns| x 9 (18 for decryption)
+#    for the MixColumns values, ordered as in aes_mix_columns_8bit_and_leak.
+#
+#  EXAMPLE:
+#
+#  records = aes_crypt_8bit_record(inputs, key, 1, {'B1': [3]})
+#  sbox_out = records['B1'][:, 0]
+
+
+def _aes_step(index):
+	#  the operation of the encryption that makes state 'index' from state
+	#  index - 1, and its round
+	if index == 1:
+		return 'key', 0
+	if index == 40:
+		return 'key', 10
+	return ('sbox', 'shift', 'mix', 'key')[(index - 2) % 4], (index - 2) // 4 + ((index - 2) % 4 == 3)
+
+
+def _aes_mix_columns_leak(data, encrypt, leak):
+	#  the 8-bit MixColumns of aes_mix_columns_8bit_and_leak on all columns
+	#  at once; the leaked values are N x 4 x 9 (18 for the inverse)
+	a0, a1, a2, a3 = (data.reshape(-1, 4, 4)[:, :, row] for row in range(4))
+	tmp = a0 ^ a1 ^ a2 ^ a3
+	tm = [a0 ^ a1, a1 ^ a2, a2 ^ a3, a3 ^ a0]
+	xt = [AES_XTIME[t] for t in tm]
+	if encrypt == 0:
+		xtmp = AES_XTIME[tmp]
+		h1 = [xtmp ^ a0 ^ a2]
+		h2 = [xtmp ^ a1 ^ a3]
+		for h in (h1, h2):
+			h.append(AES_XTIME[h[0]])
+			h.append(AES_XTIME[h[1]])
+			h.append(h[2] ^ tmp)
+		columns = [a0 ^ xt[0] ^ h1[3], a1 ^ xt[1] ^ h2[3], a2 ^ xt[2] ^ h1[3], a3 ^ xt[3] ^ h2[3]]
+		values = [tmp, xtmp] + h1 + h2 + [v for pair in zip(tm, xt) for v in pair]
+	else:
+		columns = [a0 ^ xt[0] ^ tmp, a1 ^ xt[1] ^ tmp, a2 ^ xt[2] ^ tmp, a3 ^ xt[3] ^ tmp]
+		values = [tmp] + [v for pair in zip(tm, xt) for v in pair]
+	result = np.stack(columns, axis=2).reshape(-1, 16)
+	return result, np.stack(values, axis=2) if leak else None
+
+
+def aes_crypt_8bit_record(input_data, secret_key, encrypt, record):
+	data = np.uint8(np.reshape(np.asarray(input_data), (-1, 16)))
+	round_keys = aes_key_expansion(np.uint8(secret_key))
+	count = np.shape(data)[0]
+	if not isinstance(record, dict):
+		record = dict.fromkeys(record)
+
+	#  state index -> [(name, bytes)], MixColumns round -> [(name, columns)]
+	states = {}
+	mixes = {}
+	records = {}
+	for name, selection in record.items():
+		if isinstance(name, str) and name.startswith('MC'):
+			round = int(name[2:]) if name[2:].isdigit() else 0
+			if not 1 <= round <= 9:
+				raise ValueError('unknown MixColumns round %s' % name)
+			columns = np.arange(4) if selection is None else np.ravel(selection)
+			records[name] = np.empty([count, np.size(columns), 9 if encrypt else 18], dtype=np.uint8)
+			mixes.setdefault(round - 1, []).append((name, columns))
+		else:
+			selected = np.arange(16) if selection is None else np.ravel(selection)
+			records[name] = np.empty([count, np.size(selected)], dtype=np.uint8)
+			states.setdefault(aes_state_index(name), []).append((name, selected))
+
+	#  the MixColumns of round r sits between the states 3 + 4r and 4 + 4r
+	if encrypt == 0:
+		path = range(40, min(list(states) + [3 + 4 * r for r in mixes] + [40]) - 1, -1)
+	else:
+		path = range(0, max(list(states) + [4 + 4 * r for r in mixes] + [0]) + 1)
+
+	for start in range(0, count, AES_BATCH_CHUNK):
+		rows = slice(start, start + AES_BATCH_CHUNK)
+		state = data[rows]
+		for index in path:
+			if index != path[0]:
+				operation, round = _aes_step(index if encrypt else index + 1)
+				if operation == 'key':
+					state = state ^ round_keys[round]
+				elif operation == 'sbox':
+					state = np.take(AES_SBOX if encrypt else AES_INV_SBOX, state)
+				elif operation == 'shift':
+					state = state[:, AES_SHIFT_ROWS if encrypt else AES_INV_SHIFT_ROWS]
+				else:
+					state, leak = _aes_mix_columns_leak(state, encrypt, round in mixes)
+					for name, columns in mixes.get(round, []):
+						records[name][rows] = leak[:, columns]
+			for name, selected in states.get(index, []):
+				records[name][rows] = state[:, selected]
+	return records
+
+# function result = aes_crypt_partial(input_data, secret_key, encrypt, state)
+
+#  computes one intermediate state of AES-128 en/decryptions
+#
+#  DESCRIPTION:
+#
+#  aes_crypt_partial(input_data, secret_key, encrypt, state)
+#
+#  runs the cipher only as far as 'state' (a name or index as for
+#  aes_state_index): forward from the plaintexts for an encryption, or
+#  backwards from the ciphertexts for a decryption, e.g. the round 1
+#  S-box outputs cost one AddRoundKey and one SubBytes.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of bytes of size N x 16, the state of every line.
+#
+#  EXAMPLE:
+#
+#  labels = aes_crypt_partial(inputs, key, 1, 'B1')[:, 0]
+
+
+def aes_crypt_partial(input_data, secret_key, encrypt, state):
+	return aes_crypt_8bit_record(input_data, secret_key, encrypt, [state])[state]
+
+# function result = aes_state_guesses(data, state, byte, guesses)
+
+#  computes one byte of an early or late state under every key guess
+#
+#  DESCRIPTION:
+#
+#  aes_state_guesses(data, state, byte, guesses)
+#
+#  evaluates byte 'byte' of 'state' (the column aes_crypt_partial returns
+#  for that state) for every guess of the one key byte it depends on,
+#  using only the single-byte operations that lead to it, as one lookup
+#  of the data byte in a 256 x 256 table of the guesses. The guessed key
+#  byte, see aes_guessed_key_byte, is
+#
+#    P, K0, B1    from the plaintexts, key byte 'byte',
+#    R1           from the plaintexts, key byte AES_SHIFT_ROWS[byte],
+#    K9, B10      from the ciphertexts, byte AES_INV_SHIFT_ROWS[byte] of
+#                 the last round key,
+#    R10, C       from the ciphertexts, byte 'byte' of the last round key.
+#
+#  P and C do not depend on the key; all their columns are equal.
+#
+#  PARAMETERS:
+#
+#  - data:
+#    A matrix of bytes of size N x 16, the plaintexts or the ciphertexts.
+#  - state:
+#    The state, by name or index as for aes_state_index.
+#  - byte:
+#    The byte of the state (0..15).
+#  - guesses:
+#    The guessed values of the key byte (default: all 256).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of bytes of size N x |guesses|.
+#
+#  EXAMPLE:
+#
+#  sbox_out = aes_state_guesses(inputs, 'B1', 3)   # S[p_3 ^ k] for every k
+
+_AES_FIRST_ROUND_STATES = (0, 1, 2, 3)
+_AES_LAST_ROUND_STATES = (37, 38, 39, 40)
+
+#  AES_XOR_TABLE[d, k] = d ^ k; line d of a guess table holds the byte
+#  under every key guess, so a whole N x 256 table is one line gather
+AES_XOR_TABLE = np.uint8(np.arange(256)[:, np.newaxis] ^ np.arange(256))
+_AES_GUESS_TABLES = {
+	1: AES_XOR_TABLE, 38: AES_XOR_TABLE, 39: AES_XOR_TABLE,
+	2: AES_SBOX[AES_XOR_TABLE], 3: AES_SBOX[AES_XOR_TABLE],
+	37: AES_INV_SBOX[AES_XOR_TABLE]}
+
+
+def _aes_data_byte(index, byte):
+	#  the byte of the plaintext / ciphertext that byte 'byte' of state
+	#  'index' is computed from
+	if index == 3:
+		return AES_SHIFT_ROWS[byte]
+	if index in (37, 38):
+		return AES_INV_SHIFT_ROWS[byte]
+	return byte
+
+# function key_byte = aes_guessed_key_byte(state, byte)
+
+#  the key byte a byte of an early or late state depends on
+#
+#  DESCRIPTION:
+#
+#  aes_guessed_key_byte(state, byte)
+#
+#  returns the key byte guessed by aes_state_guesses(data, state, byte):
+#  a byte of the first round key (the secret key) for P, K0, B1 and R1,
+#  of the last round key for K9, B10, R10 and C, or None for P and C.
+#
+#  EXAMPLE:
+#
+#  aes_guessed_key_byte('R1', 1)   # 5, ShiftRows brings byte 5 to byte 1
+
+
+def aes_guessed_key_byte(state, byte):
+	index = aes_state_index(state)
+	if index not in _AES_FIRST_ROUND_STATES + _AES_LAST_ROUND_STATES:
+		raise ValueError('state %s depends on more than one key byte' % state)
+	if index in (0, 40):
+		return None
+	return int(_aes_data_byte(index, byte))
+
+
+def aes_state_guesses(data, state, byte, guesses=None):
+	index = aes_state_index(state)
+	if index not in _AES_FIRST_ROUND_STATES + _AES_LAST_ROUND_STATES:
+		raise ValueError('state %s depends on more than one key byte' % state)
+	d = np.uint8(np.asarray(data)[:, _aes_data_byte(index, byte)])
+	if index in (0, 40):
+		return np.repeat(d[:, np.newaxis], 256 if guesses is None else np.size(guesses), axis=1)
+
+	table = _AES_GUESS_TABLES[index]
+	if guesses is not None:
+		table = table[:, np.uint8(np.ravel(guesses))]
+	return np.take(table, d, axis=0)
+
+# function result = aes_mixcolumn_guesses(inputs, column, leak, guesses)
+
+#  computes a first-round 8-bit MixColumns value under every pair of key guesses
+#
+#  DESCRIPTION:
+#
+#  aes_mixcolumn_guesses(inputs, column, leak, guesses)
+#
+#  evaluates leak 'leak' of the first-round aes_mix_columns_8bit_and_leak
+#  on column 'column' for every pair of guesses of the two key bytes it
+#  depends on. With a = the column after ShiftRows, the leaks 1..8 are
+#  a[r] ^ a[r + 1] (leak 2r + 1) and its xtime (leak 2r + 2), r = 0..3;
+#  leak 0 depends on the four key bytes of the column and is not
+#  supported.
+#
+#  PARAMETERS:
+#
+#  - inputs:
+#    A matrix of bytes of size N x 16, one plaintext per line.
+#  - column:
+#    The MixColumns column (0..3).
+#  - leak:
+#    The leak number (1..8).
+#  - guesses:
+#    The guessed values of each of the two key bytes (default: all 256).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of bytes of size N x |guesses|^2 (N x 65536 by default);
+#    column i * |guesses| + j is the value for key byte
+#    AES_SHIFT_ROWS[4 * column + r] = guesses[i] and key byte
+#    AES_SHIFT_ROWS[4 * column + (r + 1) % 4] = guesses[j].
+#
+#  EXAMPLE:
+#
+#  tm = aes_mixcolumn_guesses(inputs, 0, 1)
+
+
+def aes_mixcolumn_guesses(inputs, column, leak, guesses=None):
+	if not 1 <= leak <= 8:
+		raise ValueError('MixColumns leak %d does not depend on two key bytes' % leak)
+	row = (leak - 1) // 2
+	a_1 = aes_state_guesses(inputs, 'R1', 4 * column + row, guesses)
+	a_2 = aes_state_guesses(inputs, 'R1', 4 * column + (row + 1) % 4, guesses)
+
+	result = np.bitwise_xor(a_1[:, :, np.newaxis], a_2[:, np.newaxis, :])
+	if leak % 2 == 0:
+		result = AES_XTIME[result]
+	return np.reshape(result, (np.shape(inputs)[0], -1))
@@ -0,0 +1,763 @@
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import numpy as np
+from aes_lib import AES_SBOX, AES_SBOX_HW, AES_SHIFT_ROWS, AES_XOR_TABLE, AES_XTIME, aes_mixcolumn_guesses, aes_state_guesses
+from hamming_weight import bit_count
+
+# function [result] = cpa_hypothesis(inputs, key_byte, model)
+
+#  builds the power model of every key guess for one key byte
+#
+#  DESCRIPTION:
+#
+#  cpa_hypothesis(inputs, key_byte, model)
+#
+#  calculates model[P ^ K] for every input P and every key guess K of byte
+#  'key_byte' by looking up each P in the 256 x 256 table of model[P ^ K].
+#  With the default model this is the Hamming weight of S[P ^ K].
+#
+#  PARAMETERS:
+#
+#  - inputs:
+#    A matrix of bytes of size N x 16, one plaintext per line.
+#  - key_byte:
+#    The key byte that is attacked (0..15).
+#  - model:
+#    A 256-entry table mapping P ^ K to the predicted leakage
+#    (default AES_SBOX_HW).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x 256, result[n, k] is the predicted leakage of
+#    trace n under key guess k.
+#
+#  EXAMPLE:
+#
+#  cpa_hypothesis(ws2['inputs'], 11)
+
+
+def cpa_hypothesis(inputs, key_byte, model=AES_SBOX_HW):
+	p = np.uint8(np.asarray(inputs)[:, key_byte])
+	result = np.take(np.asarray(model)[AES_XOR_TABLE], p, axis=0)
+	return result
+
+# function [result] = hd_hypothesis(data, key_byte, first, second)
+
+#  builds a Hamming distance power model of every key guess for one key byte
+#
+#  DESCRIPTION:
+#
+#  hd_hypothesis(data, key_byte, first, second)
+#
+#  predicts the Hamming distance between the values of two steps of the
+#  state progression of aes_crypt_8bit_and_leak (see its legend) for every
+#  key guess, computing only the two values involved (see
+#  aes_state_guesses). The distance is taken in a state register: between
+#  the value of key byte 'key_byte' it holds after the first step and the
+#  value it is overwritten with by the second. Both values must depend on
+#  that key byte only, or on no key:
+#
+#    (0, 2), (1, 2)            P, K and B from the plaintexts, in register
+#                              'key_byte' (first round key),
+#    37 (K), 38 (B), 40 (C)    any pair, from the ciphertexts, in register
+#                              AES_SHIFT_ROWS['key_byte'] (last round key).
+#
+#  e.g. (37, 40) is the classic last-round model HW(InvS(C[j] ^ K) ^ C[s]),
+#  s = AES_SHIFT_ROWS[j]: ShiftRows moves the ciphertext byte of another
+#  key byte into the register. The other pairs are refused: across
+#  AddRoundKey, (0, 1) and (39, 40), the distance is HW(K) for every
+#  trace, so it cannot rank the guesses, and the pairs with 3, or 37 / 38
+#  with 39, depend on two key bytes.
+#
+#  PARAMETERS:
+#
+#  - data:
+#    A matrix of bytes of size N x 16, the plaintexts (first round) or the
+#    ciphertexts (last round).
+#  - key_byte:
+#    The key byte that is attacked (0..15).
+#  - first, second:
+#    The two state indices.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x 256, result[n, k] is the predicted Hamming
+#    distance of trace n under key guess k.
+#
+#  EXAMPLE:
+#
+#  cpa(traces, hd_hypothesis(ciphertexts, 3, 37, 40))
+
+_HD_STATE_PAIRS = ({0, 1, 2}, {37, 38, 40})
+_HD_KEY_ADDITIONS = ({0, 1}, {39, 40})
+
+
+def hd_hypothesis(data, key_byte, first, second):
+	pair = {first, second}
+	if pair in _HD_KEY_ADDITIONS:
+		raise ValueError('the distance of states %d and %d is the same for every trace' % (first, second))
+	if not any(pair <= states for states in _HD_STATE_PAIRS):
+		raise ValueError('states %d and %d do not depend on a single key byte' % (first, second))
+
+	#  the state register that holds the value of the key byte; in K9 / B10
+	#  (before the last ShiftRows) that is AES_SHIFT_ROWS[key_byte]
+	register = AES_SHIFT_ROWS[key_byte] if pair & {37, 38} else key_byte
+	distance = np.bitwise_xor(aes_state_guesses(data, first, register), aes_state_guesses(data, second, register))
+	result = bit_count(np.broadcast_to(distance, (np.shape(data)[0], 256)))
+	return result
+
+# function [result] = hd_mixcolumn_hypothesis(inputs, column, row)
+
+#  builds a Hamming distance power model of the first-round 8-bit MixColumns
+#
+#  DESCRIPTION:
+#
+#  hd_mixcolumn_hypothesis(inputs, column, row)
+#
+#  predicts the Hamming distance between the successive MixColumns leaks
+#  'tm = a[row] ^ a[row + 1]' and 'xtime(tm)' of aes_mix_columns_8bit_and_leak
+#  (leaks #row+1.1 and #row+1.2) in the first round, where a is the
+#  column 'column' after ShiftRows. The leak depends on the two key bytes
+#  that end up in a[row] and a[row + 1], so every pair of guesses is a
+#  hypothesis.
+#
+#  PARAMETERS:
+#
+#  - inputs:
+#    A matrix of bytes of size N x 16, one plaintext per line.
+#  - column, row:
+#    The MixColumns column (0..3) and the first row (0..3) of the pair.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x 65536, column k1 * 256 + k2 is the hypothesis for
+#    key byte AES_SHIFT_ROWS[4 * column + row] = k1 and key byte
+#    AES_SHIFT_ROWS[4 * column + (row + 1) % 4] = k2.
+#
+#  EXAMPLE:
+#
+#  cpa(traces, hd_mixcolumn_hypothesis(inputs, 0, 0))
+
+
+def hd_mixcolumn_hypothesis(inputs, column, row):
+	tm = aes_mixcolumn_guesses(inputs, column, 2 * row + 1)
+	result = bit_count(np.bitwise_xor(tm, AES_XTIME[tm]))
+	return result
+
+# function [result] = cpa(traces, inputs, key_byte, model, poi)
+
+#  correlation power analysis of one key byte
+#
+#  DESCRIPTION:
+#
+#  cpa(traces, inputs, key_byte, model, poi)
+#
+#  correlates the hypothesis of every key guess (see cpa_hypothesis) with
+#  every sample of 'traces'. The traces are read once, block by block:
+#  their sums, sums of squares and a single N x 256 by N x T matrix
+#  product with the hypotheses. The covariance is centered afterwards
+#  from these sums.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type:
+#    int8 / uint8 / float32 traces are processed in float32, int16 and
+#    wider in float64, with float64 sums. The sums are exact for integer
+#    traces and an integer hypothesis (e.g. cpa_hypothesis); otherwise
+#    the traces are shifted by the mean of their first lines so that a DC
+#    level does not cost float32 precision.
+#  - inputs, key_byte, model:
+#    As for cpa_hypothesis. 'inputs' may also be an N x 256 hypothesis
+#    matrix, in which case 'key_byte' and 'model' are ignored.
+#  - poi:
+#    Optional points of interest, a vector of sample indices or a boolean
+#    mask of length T (see select_poi in leakage_lib). Only these samples
+#    are read and correlated.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size 256 x T holding the correlation of each key guess
+#    (line) with each sample (column), the classification_output of
+#    Lecture7. With 'poi' there is one column per point of interest.
+#
+#  EXAMPLE:
+#
+#  classification_output = cpa(ws2['traces'], ws2['inputs'], 11)
+
+
+TRACE_BLOCK_ROWS = 8192
+
+
+def _compute_type(traces):
+	#  8-bit and float32 traces are multiplied in float32, wider integer
+	#  and float64 traces in float64
+	if traces.dtype.itemsize == 1 or traces.dtype == np.float32:
+		return np.float32
+	return np.float64
+
+
+def _exact_sums(traces, hypothesis):
+	#  integer traces times an integer hypothesis are summed exactly
+	return np.asarray(traces).dtype.kind in 'biu' and np.asarray(hypothesis).dtype.kind in 'biu'
+
+
+def _trace_offset(traces, hypothesis):
+	#  the traces are shifted by the mean of their first lines before the
+	#  products so that a large DC level does not swamp the float32 sums;
+	#  exact sums need no shift
+	traces = np.asarray(traces)
+	if _exact_sums(traces, hypothesis):
+		return np.zeros(np.shape(traces)[1])
+	offset = np.mean(traces[:TRACE_BLOCK_ROWS], axis=0, dtype=np.float64)
+	return np.float64(offset.astype(_compute_type(traces)))
+
+
+def _trace_sums(traces, hypothesis, offset=None):
+	#  sum(x), sum(x^2) and hypothesis.T x of x = traces - offset, in float64.
+	#  The traces are converted block by block (lines x CPA_BLOCK_SAMPLES)
+	#  to their compute type, the full matrix is never upcast. Integer
+	#  traces times an integer hypothesis are summed exactly when they are
+	#  not shifted: the float32 blocks are short enough to stay below 2^24.
+	traces = np.asarray(traces)
+	hypothesis = np.asarray(hypothesis)
+	count, trace_length = np.shape(traces)
+	compute_type = _compute_type(traces)
+	if offset is None:
+		offset = _trace_offset(traces, hypothesis)
+	exact = _exact_sums(traces, hypothesis) and not np.any(offset)
+
+	rows = TRACE_BLOCK_ROWS
+	if exact and compute_type == np.float32:
+		h_max = max(int(np.max(np.abs(hypothesis), initial=0)), 1)
+		rows = max(min(rows, 2 ** 24 // (256 * h_max)), 1)
+	h = hypothesis.astype(compute_type, copy=False)
+
+	sum_x = np.zeros(trace_length)
+	sum_x2 = np.zeros(trace_length)
+	sum_hx = np.zeros([np.shape(h)[1], trace_length])
+	for column in range(0, trace_length, CPA_BLOCK_SAMPLES):
+		columns = slice(column, column + CPA_BLOCK_SAMPLES)
+		shift = offset[columns].astype(compute_type)
+		for start in range(0, count, rows):
+			block = traces[start:start + rows, columns]
+			if exact:
+				sum_x[columns] += np.sum(block, axis=0, dtype=np.int64)
+				sum_x2[columns] += np.einsum('ij,ij->j', block, block, dtype=np.int64, casting='unsafe')
+				block = block.astype(compute_type)
+			else:
+				block = block.astype(compute_type) - shift
+				sum_x[columns] += np.sum(block, axis=0, dtype=np.float64)
+				sum_x2[columns] += np.einsum('ij,ij->j', block, block, dtype=np.float64)
+			sum_hx[:, columns] += np.dot(h[start:start + rows].T, block)
+	return sum_x, sum_x2, sum_hx
+
+
+def _correlation(hypothesis, sum_h, sum_h2, traces):
+	#  the covariance is centered after the products, so that an integer
+	#  hypothesis keeps the exact sums of integer traces
+	count = np.shape(traces)[0]
+	sum_x, sum_x2, sum_hx = _trace_sums(traces, hypothesis)
+	cov = sum_hx - np.outer(sum_h, sum_x) / count
+	var_h = np.maximum(sum_h2 - sum_h ** 2 / count, 0)
+	var_x = np.maximum(sum_x2 - sum_x ** 2 / count, 0)
+	norm = np.sqrt(np.outer(var_h, var_x))
+
+	#  a constant hypothesis or sample has no correlation
+	result = np.divide(cov, norm, out=np.zeros(np.shape(cov)), where=norm != 0)
+	return result
+
+
+def _hypothesis_sums(hypothesis):
+	#  integer hypotheses are kept as they are, others are centered
+	hypothesis = np.asarray(hypothesis)
+	if hypothesis.dtype.kind not in 'biu':
+		hypothesis = np.double(hypothesis)
+		hypothesis = hypothesis - np.mean(hypothesis, axis=0)
+	sum_h = np.sum(hypothesis, axis=0, dtype=np.float64)
+	sum_h2 = np.einsum('ij,ij->j', hypothesis, hypothesis, dtype=np.float64)
+	return hypothesis, sum_h, sum_h2
+
+
+def _poi_samples(traces, poi):
+	#  the columns of the points of interest
+	if poi is None:
+		return traces
+	poi = np.asarray(poi)
+	if poi.dtype == np.bool_:
+		poi = np.flatnonzero(poi)
+	return np.asarray(traces)[:, poi]
+
+
+def cpa(traces, inputs, key_byte=None, model=AES_SBOX_HW, poi=None):
+	traces = _poi_samples(traces, poi)
+	if key_byte is None:
+		hypothesis = np.asarray(inputs)
+	else:
+		hypothesis = cpa_hypothesis(inputs, key_byte, model)
+
+	hypothesis, sum_h, sum_h2 = _hypothesis_sums(hypothesis)
+	result = _correlation(hypothesis, sum_h, sum_h2, traces)
+	return result
+
+# function [result] = cpa_full_key(traces, inputs, model, peaks_only, workers, poi)
+
+#  correlation power analysis of all 16 key bytes in one pass
+#
+#  DESCRIPTION:
+#
+#  cpa_full_key(traces, inputs, model, peaks_only, workers, poi)
+#
+#  stacks the hypotheses of all 16 key bytes into one N x 4096 matrix and
+#  walks over 'traces' in blocks of CPA_BLOCK_SAMPLES samples. Every block
+#  is normalized once and correlated with all 4096 hypotheses by a single
+#  matrix product, so the trace matrix is read once instead of 16 times.
+#  Blocks can be processed by several threads (numpy releases the GIL
+#  inside the matrix product).
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type as
+#    for cpa.
+#  - inputs:
+#    A matrix of bytes of size N x 16, one plaintext per line.
+#  - model:
+#    As for cpa_hypothesis.
+#  - peaks_only:
+#    If True only the highest absolute correlation of each key guess and
+#    its sample index are kept instead of the full 16 x 256 x T result.
+#  - workers:
+#    Number of threads the sample blocks are spread over.
+#  - poi:
+#    Optional points of interest, as for cpa.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size 16 x 256 x T, result[b] is cpa(traces, inputs, b),
+#    or, with peaks_only, a pair (peak, peak_time) of 16 x 256 matrices.
+#    np.argmax(peak, axis=1) is then the most likely key. peak_time holds
+#    sample indices of 'traces' also when 'poi' is given.
+#
+#  EXAMPLE:
+#
+#  [peak, peak_time] = cpa_full_key(ws2['traces'], ws2['inputs'], peaks_only=True)
+
+CPA_BLOCK_SAMPLES = 2048
+
+
+def cpa_full_key(traces, inputs, model=AES_SBOX_HW, peaks_only=False, workers=1, poi=None):
+	samples = np.arange(np.shape(traces)[1])
+	traces = _poi_samples(np.asarray(traces), poi)
+	samples = _poi_samples(samples[np.newaxis, :], poi)[0]
+	trace_length = np.shape(traces)[1]
+
+	hypothesis = np.concatenate([cpa_hypothesis(inputs, b, model) for b in range(16)], axis=1)
+	hypothesis, sum_h, sum_h2 = _hypothesis_sums(hypothesis)
+
+	if not peaks_only:
+		result = np.zeros([16 * 256, trace_length])
+
+	def attack_block(start):
+		stop = min(start + CPA_BLOCK_SAMPLES, trace_length)
+		correlation = _correlation(hypothesis, sum_h, sum_h2, traces[:, start:stop])
+		if not peaks_only:
+			result[:, start:stop] = correlation
+			return None
+		correlation = np.abs(correlation)
+		peak_time = np.argmax(correlation, axis=1)
+		return correlation[np.arange(16 * 256), peak_time], samples[peak_time + start]
+
+	starts = range(0, trace_length, CPA_BLOCK_SAMPLES)
+	if workers > 1:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			blocks = list(executor.map(attack_block, starts))
+	else:
+		blocks = [attack_block(start) for start in starts]
+
+	if not peaks_only:
+		return np.reshape(result, (16, 256, trace_length))
+
+	peak = np.zeros(16 * 256)
+	peak_time = np.zeros(16 * 256, dtype=np.int64)
+	for block_peak, block_time in blocks:
+		better = block_peak > peak
+		peak[better] = block_peak[better]
+		peak_time[better] = block_time[better]
+	return np.reshape(peak, (16, 256)), np.reshape(peak_time, (16, 256))
+
+# class CpaAccumulator(key_bytes, model, hypothesis, poi)
+
+#  incremental correlation power analysis for trace sets larger than memory
+#
+#  DESCRIPTION:
+#
+#  acc = CpaAccumulator(key_bytes, model, hypothesis, poi)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  acc.correlation()
+#
+#  keeps the running sums of x, x^2, h, h^2 and h*x for every sample x and
+#  every key hypothesis h. Traces are fed in chunks through update(), the
+#  accumulators of several workers are combined with merge(), and
+#  correlation() can be called at any time to get the result for all the
+#  traces seen so far. reset() clears the sums. The traces keep their
+#  type (see cpa); only the sums are float64. Memory is bounded by the
+#  H x T sum of h*x and does not depend on the number of traces.
+#
+#  PARAMETERS:
+#
+#  - key_bytes:
+#    A key byte (0..15) or a list of key bytes that are attacked.
+#  - model:
+#    As for cpa_hypothesis.
+#  - hypothesis:
+#    Optional function mapping a chunk of inputs to an N x H hypothesis
+#    matrix, replacing the cpa_hypothesis of 'key_bytes'.
+#  - poi:
+#    Optional points of interest, as for cpa: only these samples of every
+#    chunk are accumulated.
+#
+#  RETURNVALUES:
+#
+#  - correlation():
+#    A matrix of size 256 x T for a single key byte, len(key_bytes) x 256
+#    x T for a list of key bytes, or H x T for a custom hypothesis (T the
+#    number of points of interest with 'poi').
+#
+#  EXAMPLE:
+#
+#  acc = CpaAccumulator(11)
+#  for start in range(0, N, 10000):
+#      acc.update(traces[start:start + 10000], inputs[start:start + 10000])
+#  classification_output = acc.correlation()
+
+
+class CpaAccumulator:
+
+	def __init__(self, key_bytes=range(16), model=AES_SBOX_HW, hypothesis=None, poi=None):
+		self.key_bytes = key_bytes
+		self.model = model
+		self.hypothesis = hypothesis
+		self.poi = poi
+
+		self.reset()
+
+	def reset(self):
+		#  the sums become arrays on the first update; the samples are
+		#  summed relative to 'offset', taken from the first chunk
+		self.offset = None
+		self.count = 0
+		self.sum_x = 0.0
+		self.sum_x2 = 0.0
+		self.sum_h = 0.0
+		self.sum_h2 = 0.0
+		self.sum_hx = 0.0
+		return self
+
+	def _hypotheses(self, inputs):
+		if self.hypothesis is not None:
+			return self.hypothesis(inputs)
+		key_bytes = np.atleast_1d(self.key_bytes)
+		return np.concatenate([cpa_hypothesis(inputs, b, self.model) for b in key_bytes], axis=1)
+
+	def update(self, traces, inputs):
+		return self._update(traces, np.asarray(self._hypotheses(inputs)))
+
+	def _update(self, traces, hypothesis):
+		traces = np.asarray(_poi_samples(traces, self.poi))
+		if self.offset is None:
+			self.offset = _trace_offset(traces, hypothesis)
+		sum_x, sum_x2, sum_hx = _trace_sums(traces, hypothesis, self.offset)
+
+		self.count += np.shape(traces)[0]
+		self.sum_x = self.sum_x + sum_x
+		self.sum_x2 = self.sum_x2 + sum_x2
+		self.sum_h = self.sum_h + np.sum(hypothesis, axis=0, dtype=np.float64)
+		self.sum_h2 = self.sum_h2 + np.einsum('ij,ij->j', hypothesis, hypothesis, dtype=np.float64)
+		self.sum_hx = self.sum_hx + sum_hx
+		return self
+
+	def _shifted(self, offset):
+		#  the sums of x - self.offset rewritten as sums of x - offset
+		d = self.offset - offset
+		sum_x = self.sum_x + self.count * d
+		sum_x2 = self.sum_x2 + 2 * d * self.sum_x + self.count * d ** 2
+		sum_hx = self.sum_hx + np.outer(self.sum_h, d)
+		return sum_x, sum_x2, sum_hx
+
+	def merge(self, other):
+		if other.count == 0:
+			return self
+		if self.offset is None:
+			self.offset = other.offset
+		sum_x, sum_x2, sum_hx = other._shifted(self.offset)
+
+		self.count += other.count
+		self.sum_x = self.sum_x + sum_x
+		self.sum_x2 = self.sum_x2 + sum_x2
+		self.sum_h = self.sum_h + other.sum_h
+		self.sum_h2 = self.sum_h2 + other.sum_h2
+		self.sum_hx = self.sum_hx + sum_hx
+		return self
+
+	def correlation(self):
+		n = self.count
+		cov = n * self.sum_hx - np.outer(self.sum_h, self.sum_x)
+		var_h = np.maximum(n * self.sum_h2 - self.sum_h ** 2, 0)
+		var_x = np.maximum(n * self.sum_x2 - self.sum_x ** 2, 0)
+		norm = np.sqrt(np.outer(var_h, var_x))
+
+		#  a constant hypothesis or sample has no correlation
+		result = np.divide(cov, norm, out=np.zeros(np.shape(cov)), where=norm != 0)
+		return self._reshape(result)
+
+	def _reshape(self, result):
+		if self.hypothesis is not None:
+			return result
+		if np.ndim(self.key_bytes) == 0:
+			return np.reshape(result, (256, -1))
+		return np.reshape(result, (len(self.key_bytes), 256, -1))
+
+# function [result] = dpa_selection(inputs, key_byte, bit, model)
+
+#  builds the DPA selection function of every key guess for one key byte
+#
+#  DESCRIPTION:
+#
+#  dpa_selection(inputs, key_byte, bit, model)
+#
+#  calculates bit 'bit' of model[P ^ K] for every input P and every key
+#  guess K of byte 'key_byte'. With the default model this is a bit of the
+#  S-box output S[P ^ K].
+#
+#  PARAMETERS:
+#
+#  - inputs, key_byte, model:
+#    As for cpa_hypothesis (default model AES_SBOX).
+#  - bit:
+#    The selection bit (0 = LSB).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x 256 of zeros and ones.
+#
+#  EXAMPLE:
+#
+#  dpa_selection(ws2['inputs'], 11, 0)
+
+
+def dpa_selection(inputs, key_byte, bit=0, model=AES_SBOX):
+	result = np.bitwise_and(np.right_shift(cpa_hypothesis(inputs, key_byte, model), bit), 1)
+	return np.uint8(result)
+
+# function [result] = dpa(traces, inputs, key_byte, bit, model, poi)
+
+#  difference of means power analysis of one key byte
+#
+#  DESCRIPTION:
+#
+#  dpa(traces, inputs, key_byte, bit, model, poi)
+#
+#  splits the traces by the selection bit of every key guess (see
+#  dpa_selection) and calculates, for every sample, the mean of the traces
+#  with the bit set minus the mean of the traces with the bit cleared. The
+#  sums of all 256 partitions are obtained by one matrix product of the
+#  selection matrix with 'traces'.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type as
+#    for cpa.
+#  - inputs, key_byte, bit, model:
+#    As for dpa_selection. 'inputs' may also be an N x H matrix of
+#    selection bits, in which case 'key_byte', 'bit' and 'model' are
+#    ignored. For example, to select by bit 0 of byte 3 of the state after
+#    the first SubBytes recorded by aes_crypt_8bit_and_leak:
+#    np.bitwise_and(state[2, :, 3], 1)[:, np.newaxis]
+#  - poi:
+#    Optional points of interest, as for cpa.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size 256 x T (or H x T) holding the difference of means
+#    of each key guess (line) for each sample (column), or for each point
+#    of interest.
+#
+#  EXAMPLE:
+#
+#  classification_output = dpa(ws2['traces'], ws2['inputs'], 11, 0)
+
+
+def _difference_of_means(count, sum_s, sum_x, sum_sx):
+	#  the sums over the traces with the bit set, and the rest
+	count_0 = count - sum_s
+	sum_0 = sum_x - sum_sx
+	mean_1 = np.divide(sum_sx, sum_s[:, np.newaxis], out=np.zeros(np.shape(sum_sx)), where=sum_s[:, np.newaxis] != 0)
+	mean_0 = np.divide(sum_0, count_0[:, np.newaxis], out=np.zeros(np.shape(sum_0)), where=count_0[:, np.newaxis] != 0)
+
+	#  an empty partition gives no information
+	result = mean_1 - mean_0
+	result[(sum_s == 0) | (count_0 == 0), :] = 0
+	return result
+
+
+def dpa(traces, inputs, key_byte=None, bit=0, model=AES_SBOX, poi=None):
+	traces = _poi_samples(traces, poi)
+	if key_byte is None:
+		selection = np.asarray(inputs)
+	else:
+		selection = dpa_selection(inputs, key_byte, bit, model)
+
+	#  the difference of means does not change when all traces are shifted
+	#  by the same offset, so the shifted sums are used directly
+	sum_x, _, sum_sx = _trace_sums(traces, selection)
+	result = _difference_of_means(
+		np.shape(traces)[0], np.sum(selection, axis=0, dtype=np.float64), sum_x, sum_sx)
+	return result
+
+# class DpaAccumulator(key_bytes, bit, model, selection, poi)
+
+#  incremental difference of means power analysis
+#
+#  DESCRIPTION:
+#
+#  acc = DpaAccumulator(key_bytes, bit, model, selection, poi)
+#
+#  the DPA counterpart of CpaAccumulator: it takes the same chunks through
+#  update() and merge(), with the selection bits (see dpa_selection) as
+#  hypotheses, and difference_of_means() gives the DPA result for all the
+#  traces seen so far. correlation() is available as well.
+#
+#  PARAMETERS:
+#
+#  - key_bytes, bit, model:
+#    As for dpa_selection, 'key_bytes' may be a list as in CpaAccumulator.
+#  - selection:
+#    Optional function mapping a chunk of inputs to an N x H matrix of
+#    selection bits.
+#  - poi:
+#    Optional points of interest, as for CpaAccumulator.
+#
+#  RETURNVALUES:
+#
+#  - difference_of_means():
+#    A matrix shaped like CpaAccumulator.correlation().
+#
+#  EXAMPLE:
+#
+#  acc = DpaAccumulator(11, 0)
+#  acc.update(traces, inputs)
+#  classification_output = acc.difference_of_means()
+
+
+class DpaAccumulator(CpaAccumulator):
+
+	def __init__(self, key_bytes=range(16), bit=0, model=AES_SBOX, selection=None, poi=None):
+		CpaAccumulator.__init__(self, key_bytes, model, selection, poi)
+		self.bit = bit
+
+	def _hypotheses(self, inputs):
+		if self.hypothesis is not None:
+			return self.hypothesis(inputs)
+		key_bytes = np.atleast_1d(self.key_bytes)
+		return np.concatenate([dpa_selection(inputs, b, self.bit, self.model) for b in key_bytes], axis=1)
+
+	def difference_of_means(self):
+		result = _difference_of_means(self.count, self.sum_h, self.sum_x, self.sum_hx)
+		return self._reshape(result)
+
+# function [accumulator] = parallel_accumulate(accumulator, source, workers, chunk_size, window, inputs)
+
+#  feeds a trace set to an accumulator on several processes
+#
+#  DESCRIPTION:
+#
+#  parallel_accumulate(accumulator, source, workers, chunk_size, window, inputs)
+#
+#  splits the traces into one contiguous range of lines per worker
+#  process. Every worker maps the traces from disk itself, so no trace is
+#  pickled, runs a fresh copy of 'accumulator' over its range chunk by
+#  chunk (see trace_chunks), and the partial sums are merged into
+#  'accumulator' in the order of the lines. The result equals the one of a
+#  single process up to floating-point rounding.
+#
+#  Each worker runs its own matrix products: set OPENBLAS_NUM_THREADS /
+#  OMP_NUM_THREADS / MKL_NUM_THREADS to 1 before numpy is imported to
+#  avoid oversubscribing the cores.
+#
+#  PARAMETERS:
+#
+#  - accumulator:
+#    A CpaAccumulator, DpaAccumulator or any object with reset(),
+#    update(traces, inputs) and merge(other). It must be picklable, so a
+#    custom hypothesis must be a module-level function.
+#  - source:
+#    A TraceStore or the folder of one, a .npy file of traces, or a
+#    (traces, inputs) pair of arrays. Arrays are written once to temporary
+#    .npy files that the workers map.
+#  - workers:
+#    Number of processes (default: the number of cores).
+#  - chunk_size, window, inputs:
+#    As for trace_chunks.
+#
+#  RETURNVALUES:
+#
+#  - accumulator:
+#    'accumulator', updated with all the traces.
+#
+#  EXAMPLE:
+#
+#  acc = parallel_accumulate(CpaAccumulator(range(16)), 'capture', 64, window=(0, 30000))
+#  classification_output = acc.correlation()
+
+
+def _accumulate_lines(accumulator, source, inputs, lines, chunk_size, window):
+	from trace_lib import trace_chunks, accumulate
+	chunks = trace_chunks(source, chunk_size, window, slice(*lines), inputs)
+	return accumulate(accumulator.reset(), chunks)
+
+
+def parallel_accumulate(accumulator, source, workers=None, chunk_size=None, window=None, inputs='inputs'):
+	from trace_lib import TraceStore, TRACE_CHUNK_SIZE
+
+	workers = workers or os.cpu_count()
+	chunk_size = chunk_size or TRACE_CHUNK_SIZE
+	spill = None
+	try:
+		if isinstance(source, tuple):
+			#  arrays in memory are shared through memory-mapped files
+			spill = tempfile.mkdtemp()
+			np.save(os.path.join(spill, 'traces.npy'), source[0])
+			np.save(os.path.join(spill, 'inputs.npy'), source[1])
+			source, inputs = os.path.join(spill, 'traces.npy'), os.path.join(spill, 'inputs.npy')
+		if isinstance(source, TraceStore):
+			source = source.path
+
+		if os.path.isdir(source):
+			count = TraceStore(source).shape[0]
+		else:
+			count = np.shape(np.load(source, mmap_mode='r'))[0]
+		bounds = np.linspace(0, count, min(workers, count) + 1).astype(np.int64)
+
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+			partials = [
+				executor.submit(_accumulate_lines, accumulator, source, inputs, (start, stop), chunk_size, window)
+				for start, stop in zip(bounds[:-1], bounds[1:])]
+			for partial in partials:
+				accumulator.merge(partial.result())
+	finally:
+		if spill is not None:
+			shutil.rmtree(spill)
+	return accumulator
@@ -1,46 +1,56 @@
 import numpy as np
 
+# %HW_TABLE_8 / HW_TABLE_16 Hamming weight of every 8-bit and 16-bit value
+HW_TABLE_8 = np.uint8([bin(x).count("1") for x in range(2**8)])
+HW_TABLE_8.setflags(write=False)
+HW_TABLE_16 = np.uint8(HW_TABLE_8[np.arange(2**16) & 0xff] + HW_TABLE_8[np.arange(2**16) >> 8])
+HW_TABLE_16.setflags(write=False)
+
+
+def bit_count(_input):
+	# function [ hw ] = bit_count( input )
+	# %BIT_COUNT Hamming weight of every element of an integer input of any shape
+	# % The result has the shape of the input and dtype uint8. numpy's
+	# % bitwise_count is used when available, otherwise a lookup table on the
+	# % 8 or 16-bit words of the input.
+	_input = np.asarray(_input)
+	if _input.dtype == np.bool_:
+		return np.uint8(_input)
+	if not np.issubdtype(_input.dtype, np.integer):
+		_input = _input.astype(np.uint64)
+	# % signed values are counted in two's complement
+	_input = _input.astype(_input.dtype.newbyteorder('='), copy=False)
+	_input = _input.view('u%d' % _input.dtype.itemsize)
+
+	if hasattr(np, 'bitwise_count'):
+		return np.bitwise_count(_input)
+	if _input.dtype == np.uint8:
+		return HW_TABLE_8[_input]
+	# % split into 16-bit words and add up their weights
+	words = np.ascontiguousarray(_input).view(np.uint16)
+	words = np.reshape(words, np.shape(_input) + (_input.dtype.itemsize // 2,))
+	return np.uint8(np.sum(HW_TABLE_16[words], axis=-1, dtype=np.uint8))
 
-def hamming_weight2(_input):
-
-	# %HAMMING_WEIGHT Hamming weight for rows of an input of any size
-	input_as_uint32 = np.uint32(np.reshape(_input, np.shape(_input)))
-	hw = np.zeros(np.shape(_input)[0])
 
-	# % while there are still nonzero values in the vector
-	while np.count_nonzero(input_as_uint32) > 0:
-		# % take the LSBs of all the input
-		hw = hw + np.sum((input_as_uint32 & 1), 1)
-		# % shift it right by one position
-		input_as_uint32 = input_as_uint32 >> 1
+def hamming_weight2(_input):
 
-	# % remove redundant dimensions
-	hw = np.squeeze(np.transpose(hw))
-	return np.sum(hw)
+	# %HAMMING_WEIGHT2 total Hamming weight of an input of any size
+	return np.sum(bit_count(_input), dtype=np.int64)
 
 
 def hamming_weight(_input):
 	# function [ hw ] = hamming_weight( input )
 	# %HAMMING_WEIGHT Hamming weight for rows of an input of any size
-	if np.shape(_input).__len__() == 0:
-		return bin(_input).count("1")
-	if np.shape(_input).__len__() > 2:
-		dim = 1
-		for n in np.shape(_input):
-			dim *= n
-		dim1 = np.shape(_input)[0]
-		dim = int(dim / dim1)
-		input_as_uint32 = np.uint32(np.reshape(_input, (dim1, dim)))
-		hw = np.zeros((np.shape(_input)[0], 1))
-		# % while there are still nonzero values in the vector
-		while np.count_nonzero(input_as_uint32) > 0:
-			# % take the LSBs of all the input
-			hw = hw + np.reshape(np.transpose(np.sum((np.squeeze(input_as_uint32) & 1), 1)), newshape=np.shape(hw))
-			# % shift it right by one position
-			input_as_uint32 = input_as_uint32 >> 1
-
-		# % remove redundant dimensions
-		hw = np.squeeze(np.transpose(hw))
-		return hw
-	else:
-		return hamming_weight2(_input)
+	# % A scalar gives an int, a vector its total weight and an input with
+	# % two or more dimensions the weight of every line (first dimension).
+	# % Use bit_count for the element-wise weights.
+	if np.ndim(_input) == 0:
+		return int(bit_count(_input))
+	hw = bit_count(_input)
+	if np.ndim(hw) == 1:
+		return np.sum(hw, dtype=np.int64)
+
+	hw = np.sum(hw, axis=tuple(range(1, np.ndim(hw))), dtype=np.int64)
+	# % remove redundant dimensions
+	hw = np.squeeze(hw)
+	return hw
@@ -0,0 +1,457 @@
+from math import comb
+import numpy as np
+
+# function [count, mean, m] = chunk_moments(traces, order)
+
+#  mean and central moment sums of every sample of a chunk of traces
+#
+#  DESCRIPTION:
+#
+#  [count, mean, m] = chunk_moments(traces, order)
+#
+#  computes, for every sample (column) of 'traces', the mean and the sums
+#  of the powers 2..order of the deviations from the mean, M_p = sum((x -
+#  mean)^p), with two passes in float64. The traces keep their type; only
+#  blocks of MOMENT_BLOCK_SIZE elements are converted at a time.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - order:
+#    The highest power (default 2).
+#
+#  RETURNVALUES:
+#
+#  - count:
+#    N.
+#  - mean:
+#    A vector of length T.
+#  - m:
+#    A matrix of size (order - 1) x T, m[p - 2] is M_p.
+#
+#  EXAMPLE:
+#
+#  [count, mean, m] = chunk_moments(ws2['traces'])
+#  variance = m[0] / (count - 1)
+
+MOMENT_BLOCK_SIZE = 2 ** 21
+
+
+def chunk_moments(traces, order=2):
+	traces = np.asarray(traces)
+	count, trace_length = np.shape(traces)
+	mean = np.zeros(trace_length)
+	m = np.zeros([order - 1, trace_length])
+	if count == 0:
+		return count, mean, m
+	columns = max(MOMENT_BLOCK_SIZE // max(count, 1), 1)
+	for start in range(0, trace_length, columns):
+		block = np.double(traces[:, start:start + columns])
+		mean[start:start + columns] = np.mean(block, axis=0)
+		deviation = block - mean[start:start + columns]
+		power = deviation
+		for p in range(2, order + 1):
+			power = power * deviation
+			m[p - 2, start:start + columns] = np.sum(power, axis=0)
+	return count, mean, m
+
+
+def _combine_moments(count_a, mean_a, m_a, count_b, mean_b, m_b):
+	#  pairwise update of the count, mean and central sums of two sets
+	#  (Chan et al., generalized by Pebay): the deviations of each set are
+	#  moved to the common mean with the binomial expansion
+	count = count_a + count_b
+	delta = mean_b - mean_a
+	shift_a = -delta * (count_b / count)
+	shift_b = delta * (count_a / count)
+
+	#  M_0 = count and M_1 = 0 for both sets
+	sums_a = [count_a, 0] + list(m_a)
+	sums_b = [count_b, 0] + list(m_b)
+	m = np.zeros(np.shape(m_a))
+	for p in range(2, len(sums_a)):
+		for k in range(0, p + 1):
+			if p - k == 1:
+				continue
+			m[p - 2] += comb(p, k) * (sums_a[p - k] * shift_a ** k + sums_b[p - k] * shift_b ** k)
+	mean = mean_a + delta * (count_b / count)
+	return count, mean, m
+
+# function [t] = welch_ttest(traces, groups, order)
+
+#  Welch's t-test of every sample between two groups of traces
+#
+#  DESCRIPTION:
+#
+#  welch_ttest(traces, groups, order)
+#
+#  calculates, for every sample, Welch's t statistic between the traces of
+#  group 0 (e.g. fixed inputs) and the traces of group 1 (e.g. random
+#  inputs), the TVLA test. |t| > TVLA_THRESHOLD (4.5) indicates leakage.
+#  It is TtestAccumulator(order=order).update(traces, groups).ttest().
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - groups:
+#    A vector of N group labels, 0 or 1 (or False / True).
+#  - order:
+#    The order of the test, see TtestAccumulator (default 1).
+#
+#  RETURNVALUES:
+#
+#  - t:
+#    A vector of length T.
+#
+#  EXAMPLE:
+#
+#  t = welch_ttest(traces, groups)
+#  leaking_samples = np.flatnonzero(np.abs(t) > TVLA_THRESHOLD)
+
+TVLA_THRESHOLD = 4.5
+
+
+def welch_ttest(traces, groups, order=1):
+	return TtestAccumulator(order=order).update(traces, groups).ttest()
+
+# class TtestAccumulator(checkpoints, threshold, order)
+
+#  streaming fixed-vs-random t-test (TVLA) of order 1, 2, 3, ...
+#
+#  DESCRIPTION:
+#
+#  acc = TtestAccumulator(checkpoints, threshold, order)
+#  acc.update(traces, groups)
+#  acc.merge(other)
+#  acc.reset()
+#  acc.ttest()
+#
+#  keeps the count, mean and the central sums M_2..M_2d (d = 'order') of
+#  every sample for each of the two groups. Every chunk fed through
+#  update() is reduced with chunk_moments and combined with the running
+#  sums by the pairwise update, as are the accumulators of several workers
+#  in merge(), so any number of traces can be processed in one pass with
+#  memory independent of N.
+#
+#  The test of order d compares the groups' means of (x - mean)^2 for
+#  d = 2, and of ((x - mean) / std)^d for d >= 3 (univariate higher-order
+#  test of Schneider and Moradi), which detects the leakage of masked
+#  implementations that is invisible at order 1.
+#
+#  After every update and merge the t statistic is evaluated:
+#  first_crossing[j] is the number of traces seen when |t| of sample j was
+#  first found above 'threshold' (0 if never), and first_leak() the
+#  smallest of them. The crossing is only as fine as the chunks: |t| first
+#  exceeded the threshold somewhere within the chunk (or the merged
+#  accumulator) that ends at that count. When the number of traces
+#  reaches one of 'checkpoints' (a chunk is split there if needed),
+#  (count, t) is appended to 'history', so the t-traces at 10^4, 10^5, ...
+#  traces come out of one pass over the data.
+#
+#  The crossings and checkpoints of an accumulator count its own traces:
+#  merge() keeps the crossings of 'other' only when it holds the first
+#  traces (an empty accumulator), and accumulators with checkpoints cannot
+#  be merged (nor run by parallel_accumulate).
+#
+#  PARAMETERS:
+#
+#  - checkpoints:
+#    Trace counts at which the t-trace is recorded in 'history'.
+#  - threshold:
+#    The leakage threshold on |t| (default TVLA_THRESHOLD).
+#  - order:
+#    The order d of the test (default 1).
+#
+#  RETURNVALUES:
+#
+#  - ttest():
+#    A vector of length T of Welch's t statistic, group 0 minus group 1.
+#
+#  EXAMPLE:
+#
+#  acc = TtestAccumulator(checkpoints=[10**4, 10**5, 10**6])
+#  accumulate(acc, trace_chunks('tvla_capture', inputs='groups'))
+#  t = acc.ttest()
+#  for count, t_count in acc.history:
+#      print(count, np.max(np.abs(t_count)))
+
+
+class TtestAccumulator:
+
+	def __init__(self, checkpoints=(), threshold=TVLA_THRESHOLD, order=1):
+		self.checkpoints = sorted(checkpoints)
+		self.threshold = threshold
+		self.order = order
+		self.reset()
+
+	def reset(self):
+		#  the moments become arrays on the first update; m[g, p - 2] is
+		#  the central sum M_p of group g
+		self.count = np.zeros(2, dtype=np.int64)
+		self.mean = None
+		self.m = None
+		self.first_crossing = None
+		self.history = []
+		return self
+
+	def _add(self, group, count, mean, m):
+		if self.mean is None:
+			self.mean = np.zeros([2, np.size(mean)])
+			self.m = np.zeros([2, 2 * self.order - 1, np.size(mean)])
+			self.first_crossing = np.zeros(np.size(mean), dtype=np.int64)
+		if count == 0:
+			return
+		self.count[group], self.mean[group], self.m[group] = _combine_moments(
+			self.count[group], self.mean[group], self.m[group], count, mean, m)
+
+	def _evaluate(self):
+		total = int(np.sum(self.count))
+		t = self.ttest()
+		crossed = (np.abs(t) > self.threshold) & (self.first_crossing == 0)
+		self.first_crossing[crossed] = total
+		if total in self.checkpoints:
+			self.history.append((total, t))
+
+	def update(self, traces, groups):
+		traces = np.asarray(traces)
+		groups = np.ravel(groups) != 0
+
+		start = 0
+		while start < np.shape(traces)[0]:
+			#  stop at the next checkpoint inside this chunk
+			total = int(np.sum(self.count))
+			stop = np.shape(traces)[0]
+			for checkpoint in self.checkpoints:
+				if checkpoint > total:
+					stop = min(stop, start + checkpoint - total)
+					break
+
+			for group in (0, 1):
+				rows = traces[start:stop][groups[start:stop] == group]
+				self._add(group, *chunk_moments(rows, 2 * self.order))
+			self._evaluate()
+			start = stop
+		return self
+
+	def merge(self, other):
+		if self.checkpoints or other.checkpoints:
+			raise ValueError('the checkpoints of merged t-tests would count the traces of one part only')
+		if other.mean is None:
+			return self
+		first = self.mean is None
+		for group in (0, 1):
+			self._add(group, other.count[group], other.mean[group], other.m[group])
+		if first:
+			self.first_crossing = other.first_crossing.copy()
+		self._evaluate()
+		return self
+
+	def _statistic(self, group):
+		#  mean and variance of the preprocessed samples of one group
+		d = self.order
+		count = max(self.count[group], 1)
+		if d == 1:
+			return self.mean[group], self.m[group, 0] / max(count - 1, 1)
+
+		#  central moments CM_p = M_p / n
+		cm = self.m[group] / count
+		if d == 2:
+			return cm[0], cm[2] - cm[0] ** 2
+		cm2 = np.maximum(cm[0], np.finfo(float).tiny)
+		return cm[d - 2] / cm2 ** (d / 2), (cm[2 * d - 2] - cm[d - 2] ** 2) / cm2 ** d
+
+	def ttest(self):
+		mean_0, variance_0 = self._statistic(0)
+		mean_1, variance_1 = self._statistic(1)
+		count = np.maximum(self.count, 1)
+		norm = np.sqrt(np.maximum(variance_0 / count[0] + variance_1 / count[1], 0))
+
+		#  a constant sample does not leak
+		diff = mean_0 - mean_1
+		t = np.divide(diff, norm, out=np.zeros(np.shape(diff)), where=norm != 0)
+		return t
+
+	def first_leak(self):
+		crossings = self.first_crossing[self.first_crossing > 0]
+		return int(np.min(crossings)) if np.size(crossings) else 0
+
+# class SnrAccumulator(classes, label)
+
+#  streaming signal-to-noise ratio and NICV of every sample
+#
+#  DESCRIPTION:
+#
+#  acc = SnrAccumulator(classes, label)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  acc.snr()
+#  acc.nicv()
+#
+#  groups the traces by the value of a known intermediate (the class, e.g.
+#  a byte of the state of aes_crypt_8bit_and_leak under the known key) and
+#  keeps, for every class and sample, the count, mean and M2. A chunk is
+#  sorted by class once and reduced with np.add.reduceat, then combined
+#  with the running moments by Chan's update, so one pass over the traces
+#  gives
+#
+#    snr  = Var(E[x | class]) / E[Var(x | class)]
+#    nicv = Var(E[x | class]) / Var(x)
+#
+#  The samples with the highest values are the points of interest, see
+#  select_poi.
+#
+#  PARAMETERS:
+#
+#  - classes:
+#    The number of classes (default 256, one per byte value).
+#  - label:
+#    Optional function mapping a chunk of inputs to the vector of class
+#    labels; without it the inputs are the labels. It must be a
+#    module-level function for parallel_accumulate.
+#
+#  RETURNVALUES:
+#
+#  - snr(), nicv():
+#    Vectors of length T.
+#
+#  EXAMPLE:
+#
+#  def sbox_out_3(inputs):
+#      return aes_crypt_8bit_and_leak(inputs, key, 1)[1][2, :, 3]
+#
+#  acc = accumulate(SnrAccumulator(256, sbox_out_3), trace_chunks('WS2'))
+#  poi = select_poi(acc.snr(), 200)
+
+
+class SnrAccumulator:
+
+	def __init__(self, classes=256, label=None):
+		self.classes = classes
+		self.label = label
+		self.reset()
+
+	def reset(self):
+		#  the moments become arrays on the first update
+		self.count = np.zeros(self.classes, dtype=np.int64)
+		self.mean = None
+		self.m2 = None
+		return self
+
+	def _add(self, classes, count, mean, m2):
+		if self.mean is None:
+			self.mean = np.zeros([self.classes, np.shape(mean)[1]])
+			self.m2 = np.zeros([self.classes, np.shape(mean)[1]])
+		combined = _combine_moments(
+			self.count[classes, np.newaxis], self.mean[classes], self.m2[np.newaxis, classes],
+			count[:, np.newaxis], mean, m2[np.newaxis])
+		self.count[classes] = np.ravel(combined[0])
+		self.mean[classes] = combined[1]
+		self.m2[classes] = combined[2][0]
+
+	def update(self, traces, inputs):
+		traces = np.asarray(traces)
+		labels = np.ravel(self.label(inputs) if self.label is not None else inputs).astype(np.intp)
+
+		#  the lines of every class are made contiguous
+		order = np.argsort(labels, kind='stable')
+		classes, starts, count = np.unique(labels[order], return_index=True, return_counts=True)
+
+		trace_length = np.shape(traces)[1]
+		mean = np.zeros([np.size(classes), trace_length])
+		m2 = np.zeros([np.size(classes), trace_length])
+		columns = max(MOMENT_BLOCK_SIZE // max(np.size(labels), 1), 1)
+		for start in range(0, trace_length, columns):
+			block = np.double(traces[order, start:start + columns])
+			block_mean = np.add.reduceat(block, starts, axis=0) / count[:, np.newaxis]
+			deviation = block - np.repeat(block_mean, count, axis=0)
+			mean[:, start:start + columns] = block_mean
+			m2[:, start:start + columns] = np.add.reduceat(deviation ** 2, starts, axis=0)
+
+		if np.size(classes):
+			self._add(classes, count, mean, m2)
+		return self
+
+	def merge(self, other):
+		if other.mean is None:
+			return self
+		classes = np.flatnonzero(other.count)
+		self._add(classes, other.count[classes], other.mean[classes], other.m2[classes])
+		return self
+
+	def _signal_noise(self):
+		#  the variance of the class means and the mean variance in a class
+		total = max(np.sum(self.count), 1)
+		weight = self.count / total
+		mean = np.dot(weight, self.mean)
+		signal = np.dot(weight, (self.mean - mean) ** 2)
+		noise = np.sum(self.m2, axis=0) / total
+		return signal, noise
+
+	def snr(self):
+		signal, noise = self._signal_noise()
+		return np.divide(signal, noise, out=np.zeros(np.shape(signal)), where=noise != 0)
+
+	def nicv(self):
+		signal, noise = self._signal_noise()
+		total = signal + noise
+		return np.divide(signal, total, out=np.zeros(np.shape(signal)), where=total != 0)
+
+# function [poi] = select_poi(score, count, spacing)
+
+#  ranks the points of interest of a per-sample score
+#
+#  DESCRIPTION:
+#
+#  select_poi(score, count, spacing)
+#
+#  returns the indices of the 'count' samples with the highest score (e.g.
+#  SNR, NICV or |t|), best first. With 'spacing' > 0, samples closer than
+#  'spacing' to an already chosen one are skipped, so that one wide peak
+#  does not take all the places.
+#
+#  PARAMETERS:
+#
+#  - score:
+#    A vector of length T.
+#  - count:
+#    The number of points of interest.
+#  - spacing:
+#    The minimal distance between two points of interest (default 0).
+#
+#  RETURNVALUES:
+#
+#  - poi:
+#    A vector of at most 'count' sample indices. poi_mask(poi, T) turns it
+#    into a boolean mask; both can be given as 'poi' to cpa, dpa,
+#    cpa_full_key and the accumulators of attack_lib.
+#
+#  EXAMPLE:
+#
+#  poi = select_poi(acc.snr(), 200, 5)
+#  classification_output = cpa(traces, inputs, 11, poi=poi)
+
+
+def select_poi(score, count, spacing=0):
+	order = np.argsort(-np.nan_to_num(np.asarray(score, dtype=np.float64), nan=-np.inf), kind='stable')
+	if spacing == 0:
+		return order[:count]
+
+	poi = []
+	taken = np.zeros(np.size(order), dtype=np.bool_)
+	for sample in order:
+		if taken[sample]:
+			continue
+		poi.append(sample)
+		if len(poi) == count:
+			break
+		taken[max(sample - spacing + 1, 0):sample + spacing] = True
+	return np.array(poi, dtype=np.int64)
+
+
+def poi_mask(poi, trace_length):
+	mask = np.zeros(trace_length, dtype=np.bool_)
+	mask[poi] = True
+	return mask
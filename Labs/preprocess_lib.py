@@ -0,0 +1,474 @@
+import concurrent.futures
+import numpy as np
+from trace_lib import TraceStore, trace_chunks, trace_store_create, TRACE_CHUNK_SIZE
+
+# function [aligned, shifts] = align_traces(traces, reference, windows, max_shift, out, workers)
+
+#  aligns traces on a reference trace by FFT cross-correlation
+#
+#  DESCRIPTION:
+#
+#  [aligned, shifts] = align_traces(traces, reference, windows, max_shift, out, workers)
+#
+#  looks, for every trace, for the shift s in -max_shift..max_shift for
+#  which traces[n, start + s:stop + s] best matches the pattern
+#  reference[start:stop], and moves the trace by -s. The cross-correlation
+#  of all the traces with the (zero-mean) pattern is computed at once with
+#  numpy.fft, over the search segment around the window only, and the
+#  shifts are applied with one slice copy per trace.
+#
+#  With a single window (static alignment) the whole trace is shifted.
+#  With a list of windows (elastic alignment) every window of the output
+#  is taken with its own shift and the samples outside the windows are
+#  copied unchanged. Samples shifted in from beyond the ends of a trace
+#  repeat its first or last sample.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - reference:
+#    A vector of length T, e.g. the first trace or the mean trace.
+#  - windows:
+#    A (start, stop) pair, or a list of (start, stop) pairs.
+#  - max_shift:
+#    The largest shift searched, in samples.
+#  - out:
+#    Optional N x T output, e.g. rows of a TraceStore opened 'r+'; it must
+#    not overlap 'traces'.
+#  - workers:
+#    Number of threads the traces are spread over.
+#
+#  RETURNVALUES:
+#
+#  - aligned:
+#    The aligned traces, of the type of 'traces' (or 'out').
+#  - shifts:
+#    The shift of every trace (N), or of every trace and window (N x W).
+#
+#  EXAMPLE:
+#
+#  [aligned, shifts] = align_traces(traces, traces[0], (2000, 3000), 200)
+
+ALIGN_BLOCK_ROWS = 1024
+
+
+def _fft_length(length):
+	#  a power of two, or three times one, at least 'length'
+	n = 1 << max(int(length - 1).bit_length(), 0)
+	if 3 * n // 4 >= length:
+		return 3 * n // 4
+	return n
+
+
+def _pattern_shifts(traces, pattern, start, max_shift):
+	#  argmax over s of sum_j traces[n, start + s + j] * pattern[j]
+	trace_length = np.shape(traces)[1]
+	first = start - max_shift
+	last = start + np.size(pattern) + max_shift
+	segment = traces[:, max(first, 0):min(last, trace_length)]
+	if first < 0 or last > trace_length:
+		segment = np.pad(segment, ((0, 0), (max(-first, 0), max(last - trace_length, 0))), mode='edge')
+
+	n = _fft_length(np.shape(segment)[1] + np.size(pattern))
+	spectrum = np.fft.rfft(segment, n, axis=1) * np.conj(np.fft.rfft(pattern, n))
+	correlation = np.fft.irfft(spectrum, n, axis=1)[:, :2 * max_shift + 1]
+	return np.argmax(correlation, axis=1) - max_shift
+
+
+def _shift_rows(traces, shifts, start, stop, out):
+	#  out[n, start:stop] = traces[n, start + s:stop + s], edges repeated.
+	#  One slice copy per line moves the samples once, where fancy indexing
+	#  of all the lines with the same shift would copy them twice.
+	trace_length = np.shape(traces)[1]
+	for n, shift in enumerate(shifts):
+		first = min(max(start + shift, 0), trace_length)
+		last = min(max(stop + shift, 0), trace_length)
+		inner_start = first - shift
+		inner_stop = last - shift
+		if last > first:
+			out[n, inner_start:inner_stop] = traces[n, first:last]
+		if inner_start > start:
+			out[n, start:inner_start] = traces[n, 0]
+		if inner_stop < stop:
+			out[n, inner_stop:stop] = traces[n, trace_length - 1]
+
+
+def align_traces(traces, reference, windows, max_shift, out=None, workers=1):
+	traces = np.asarray(traces)
+	count, trace_length = np.shape(traces)
+	elastic = np.ndim(windows) == 2
+	if not elastic:
+		windows = [windows]
+	if out is None:
+		out = np.empty_like(traces)
+
+	patterns = []
+	for start, stop in windows:
+		pattern = np.double(reference[start:stop])
+		patterns.append(pattern - np.mean(pattern))
+	shifts = np.zeros([count, len(windows)], dtype=np.int64)
+
+	def align_block(first):
+		rows = slice(first, min(first + ALIGN_BLOCK_ROWS, count))
+		block = traces[rows]
+		for w, (start, stop) in enumerate(windows):
+			shifts[rows, w] = _pattern_shifts(block, patterns[w], start, max_shift)
+
+		if not elastic:
+			_shift_rows(block, shifts[rows, 0], 0, trace_length, out[rows])
+			return
+		out[rows] = block
+		for w, (start, stop) in enumerate(windows):
+			_shift_rows(block, shifts[rows, w], start, stop, out[rows])
+
+	starts = range(0, count, ALIGN_BLOCK_ROWS)
+	if workers > 1:
+		with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+			list(executor.map(align_block, starts))
+	else:
+		for first in starts:
+			align_block(first)
+
+	return out, shifts if elastic else shifts[:, 0]
+
+# function [store] = align_store(source, reference, windows, max_shift, destination, chunk_size, workers)
+
+#  aligns all the traces of a trace store
+#
+#  DESCRIPTION:
+#
+#  align_store(source, reference, windows, max_shift, destination, chunk_size, workers)
+#
+#  reads the trace store 'source' chunk by chunk, aligns every chunk with
+#  align_traces and writes it into the trace store 'destination', which is
+#  created with the shape, type and sidecars of 'source'. Without
+#  'destination' the traces are aligned in place. The shifts are saved as
+#  the sidecar 'shifts'.
+#
+#  PARAMETERS:
+#
+#  - source:
+#    A TraceStore or the folder of one.
+#  - reference, windows, max_shift, workers:
+#    As for align_traces.
+#  - destination:
+#    The folder of the aligned store (default: 'source', in place).
+#  - chunk_size:
+#    Number of traces read at a time.
+#
+#  RETURNVALUES:
+#
+#  - store:
+#    The aligned TraceStore, opened read only.
+#
+#  EXAMPLE:
+#
+#  ws2 = TraceStore('WS2')
+#  aligned = align_store(ws2, np.mean(ws2['traces'][:100], axis=0), (2000, 3000), 200, 'WS2_aligned')
+
+
+def align_store(source, reference, windows, max_shift, destination=None, chunk_size=TRACE_CHUNK_SIZE, workers=1):
+	if not isinstance(source, TraceStore):
+		source = TraceStore(source)
+	if destination is None:
+		target = TraceStore(source.path, 'r+')
+	else:
+		sidecars = {name: source[name] for name in source.keys() if name != 'traces'}
+		target = trace_store_create(destination, source.shape, source.traces.dtype, source.sampling, **sidecars)
+
+	shifts = []
+	start = 0
+	for traces, _ in trace_chunks(source, chunk_size, inputs=None):
+		rows = slice(start, start + np.shape(traces)[0])
+		shifts.append(align_traces(traces, reference, windows, max_shift, target.traces[rows], workers)[1])
+		start = rows.stop
+	target.flush()
+	target['shifts'] = np.concatenate(shifts)
+
+	path = target.path
+	del target
+	return TraceStore(path)
+
+# function [result] = integrate_traces(traces, period, mode, offset)
+
+#  compresses traces to one value per clock cycle
+#
+#  DESCRIPTION:
+#
+#  integrate_traces(traces, period, mode, offset)
+#
+#  splits every trace into windows of 'period' samples starting at
+#  'offset' and keeps one value per window: the sum of the samples, the
+#  sum of their absolute values or their maximum. The period may be
+#  fractional (e.g. 12.5 samples per clock at 500 MS/s and 40 MHz); the
+#  window boundaries are then rounded. All traces and windows are reduced
+#  at once with np.add.reduceat / np.maximum.reduceat. The samples after
+#  the last full window are dropped.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - period:
+#    The window length in samples.
+#  - mode:
+#    'sum' (default), 'abs' or 'peak'.
+#  - offset:
+#    The first sample of the first window (default 0).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x W, W the number of full windows (0 when the
+#    traces are shorter than one window). Sums are
+#    float32 for traces of up to 16-bit integers or float32 and float64
+#    otherwise; peaks keep the type of 'traces'.
+#
+#  EXAMPLE:
+#
+#  cycles = integrate_traces(ws2['traces'], 12.5, 'abs')
+
+
+def integrate_traces(traces, period, mode='sum', offset=0):
+	traces = np.asarray(traces)
+	windows = max(int((np.shape(traces)[1] - offset) // period), 0)
+	bounds = np.round(offset + period * np.arange(windows + 1)).astype(np.int64)
+	traces = traces[:, bounds[0]:bounds[-1]]
+	starts = bounds[:-1] - bounds[0]
+
+	dtype = traces.dtype if mode == 'peak' else np.result_type(traces.dtype, np.float32)
+	if mode not in ('sum', 'abs', 'peak'):
+		raise ValueError('unknown integration mode %s' % mode)
+	if windows == 0:
+		#  reduceat needs at least one window
+		return np.zeros([np.shape(traces)[0], 0], dtype=dtype)
+
+	if mode == 'peak':
+		return np.maximum.reduceat(traces, starts, axis=1)
+	if mode == 'abs':
+		traces = np.abs(traces.astype(dtype, copy=False))
+	return np.add.reduceat(traces, starts, axis=1, dtype=dtype)
+
+# function [result] = decimate_traces(traces, factor, taps)
+
+#  low-pass filters and downsamples traces by an integer factor
+#
+#  DESCRIPTION:
+#
+#  decimate_traces(traces, factor, taps)
+#
+#  filters every trace with a linear-phase low-pass FIR filter (a
+#  Hamming-windowed sinc with its cutoff at the new Nyquist frequency) and
+#  keeps every factor-th sample. Only the kept outputs are computed, in
+#  polyphase form: taps / factor matrix-vector products over all the
+#  traces, each reading the traces once. The filter is centered, output k is
+#  aligned with input sample k * factor; the traces are extended by their
+#  edge values.
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - factor:
+#    The integer decimation factor.
+#  - taps:
+#    The number of filter taps, odd (default 8 * factor + 1).
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x (T // factor), float32 for traces of up to
+#    16-bit integers or float32 and float64 otherwise.
+#
+#  EXAMPLE:
+#
+#  decimated = decimate_traces(ws2['traces'], 10)
+
+
+def decimate_filter(factor, taps=None):
+	if taps is None:
+		taps = 8 * factor + 1
+	n = np.arange(taps) - (taps - 1) / 2
+	h = np.sinc(n / factor) * np.hamming(taps)
+	return h / np.sum(h)
+
+
+def decimate_traces(traces, factor, taps=None):
+	traces = np.asarray(traces)
+	count = np.shape(traces)[0]
+	dtype = np.result_type(traces.dtype, np.float32)
+	h = decimate_filter(factor, taps)
+	half = (np.size(h) - 1) // 2
+	outputs = np.shape(traces)[1] // factor
+
+	#  polyphase form: the padded traces are cut into blocks of 'factor'
+	#  samples and the filter into rows of 'factor' taps, so output k is
+	#  the sum over q of block k + q times filter row q
+	rows = -(-np.size(h) // factor)
+	h = np.reshape(np.pad(h, (0, rows * factor - np.size(h))), (rows, factor)).astype(dtype)
+	length = (outputs + rows - 1) * factor
+	padded = np.pad(traces, ((0, 0), (half, max(length - np.shape(traces)[1] - half, half))), mode='edge')
+	blocks = np.reshape(padded[:, :length], (count, outputs + rows - 1, factor))
+
+	result = np.zeros([count, outputs], dtype=dtype)
+	for q in range(rows):
+		result += np.matmul(blocks[:, q:q + outputs, :], h[q])
+	return result
+
+# function [result] = resample_traces(traces, samples)
+
+#  resamples traces to any number of samples
+#
+#  DESCRIPTION:
+#
+#  resample_traces(traces, samples)
+#
+#  changes the sampling rate of every trace by an arbitrary factor
+#  samples / T in the frequency domain: the spectra of all the traces are
+#  computed at once with numpy.fft, truncated (or zero padded) to the new
+#  length and transformed back, which also removes the frequencies above
+#  the new Nyquist frequency. The traces are treated as periodic; the
+#  result equals scipy.signal.resample(traces, samples, axis=1).
+#
+#  PARAMETERS:
+#
+#  - traces:
+#    A matrix of size N x T, one power trace per line, of any type.
+#  - samples:
+#    The new number of samples per trace.
+#
+#  RETURNVALUES:
+#
+#  - result:
+#    A matrix of size N x samples, float32 for traces of up to 16-bit
+#    integers or float32 and float64 otherwise.
+#
+#  EXAMPLE:
+#
+#  resampled = resample_traces(traces, 40000)   # 500 MS/s to 200 MS/s
+
+
+def resample_traces(traces, samples):
+	traces = np.asarray(traces)
+	trace_length = np.shape(traces)[1]
+	dtype = np.result_type(traces.dtype, np.float32)
+
+	spectrum = np.fft.rfft(traces, axis=1)
+	bins = samples // 2 + 1
+	if bins <= np.shape(spectrum)[1]:
+		spectrum = spectrum[:, :bins]
+	else:
+		spectrum = np.pad(spectrum, ((0, 0), (0, bins - np.shape(spectrum)[1])))
+
+	#  with an even number of common bins the last one is unpaired: it is
+	#  the sum of a bin and its mirror when shrinking, and is split between
+	#  them when growing (as scipy.signal.resample)
+	common = min(samples, trace_length)
+	if common % 2 == 0 and samples != trace_length:
+		spectrum[:, common // 2] *= 2 if samples < trace_length else 0.5
+	result = np.fft.irfft(spectrum, samples, axis=1) * (samples / trace_length)
+	return result.astype(dtype, copy=False)
+
+# function [chunks] = map_chunks(chunks, function, *args)
+
+#  applies a preprocessing stage to a stream of chunks
+#
+#  DESCRIPTION:
+#
+#  for traces, inputs in map_chunks(chunks, function, *args):
+#
+#  yields (function(traces, *args), inputs) for every chunk of 'chunks'
+#  (e.g. of trace_chunks), so preprocessing runs chunk by chunk between
+#  the trace source and the analysis.
+#
+#  EXAMPLE:
+#
+#  chunks = map_chunks(trace_chunks('capture'), integrate_traces, 12.5, 'abs')
+#  acc = accumulate(CpaAccumulator(11), chunks)
+
+
+def map_chunks(chunks, function, *args):
+	for traces, inputs in chunks:
+		yield function(traces, *args), inputs
+
+# function [store] = transform_store(source, destination, function, *args, chunk_size, sampling)
+
+#  writes a preprocessed copy of a trace store
+#
+#  DESCRIPTION:
+#
+#  transform_store(source, destination, function, *args, chunk_size=..., sampling=...)
+#
+#  reads the trace store 'source' chunk by chunk, applies
+#  function(traces, *args) (e.g. integrate_traces, decimate_traces or
+#  resample_traces) and writes the results into the new trace store
+#  'destination', with the sidecars of 'source'. The shape and type of
+#  the new traces are those of the first processed chunk (of an empty
+#  chunk for an empty store). The sampling rate of 'source' is divided by
+#  the factor or period of decimate_traces and integrate_traces, and
+#  otherwise scaled by the change of the number of samples.
+#
+#  PARAMETERS:
+#
+#  - source:
+#    A TraceStore or the folder of one.
+#  - destination:
+#    The folder of the new store.
+#  - function, args:
+#    The preprocessing function and its arguments after the traces.
+#  - chunk_size:
+#    Number of traces read at a time.
+#  - sampling:
+#    The sampling information of the new store (default: that of
+#    'source' with the new rate).
+#
+#  RETURNVALUES:
+#
+#  - store:
+#    The new TraceStore, opened read only.
+#
+#  EXAMPLE:
+#
+#  transform_store('capture', 'capture_dec10', decimate_traces, 10)
+
+
+def _transformed_sampling(sampling, function, args, length, samples):
+	#  the sampling information after 'function' turned 'length' samples
+	#  into 'samples'
+	sampling = dict(sampling)
+	if 'rate' in sampling:
+		if function in (decimate_traces, integrate_traces):
+			sampling['rate'] = sampling['rate'] / args[0]
+		elif length > 0:
+			sampling['rate'] = sampling['rate'] * samples / length
+	return sampling
+
+
+def transform_store(source, destination, function, *args, chunk_size=TRACE_CHUNK_SIZE, sampling=None):
+	if not isinstance(source, TraceStore):
+		source = TraceStore(source)
+
+	def create(traces):
+		samples = np.shape(traces)[1]
+		new_sampling = sampling
+		if new_sampling is None:
+			new_sampling = _transformed_sampling(source.sampling, function, args, source.shape[1], samples)
+		sidecars = {name: source[name] for name in source.keys() if name != 'traces'}
+		return trace_store_create(destination, (source.shape[0], samples), traces.dtype, new_sampling, **sidecars)
+
+	target = None
+	start = 0
+	for traces, _ in map_chunks(trace_chunks(source, chunk_size, inputs=None), function, *args):
+		if target is None:
+			target = create(traces)
+		target.traces[start:start + np.shape(traces)[0]] = traces
+		start += np.shape(traces)[0]
+	if target is None:
+		#  no traces: the shape and type come from an empty chunk
+		target = create(function(np.asarray(source.traces[0:0]), *args))
+	target.flush()
+
+	path = target.path
+	del target
+	return TraceStore(path)
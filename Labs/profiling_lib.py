@@ -0,0 +1,657 @@
+import numpy as np
+from aes_lib import aes_state_guesses
+from attack_lib import CpaAccumulator
+
+# class Projection(poi, mean, matrix)
+
+#  a linear reduction of traces to a few features
+#
+#  DESCRIPTION:
+#
+#  projection = Projection(poi, mean, matrix)
+#  features = projection(traces)
+#
+#  keeps the samples 'poi' of every trace, subtracts 'mean' and multiplies
+#  by 'matrix': features = (traces[:, poi] - mean) @ matrix. Every part is
+#  optional. PcaAccumulator and LdaAccumulator return a Projection, which
+#  can be applied chunk by chunk, e.g. with map_chunks(chunks, projection).
+#
+#  PARAMETERS:
+#
+#  - poi:
+#    Optional sample indices or boolean mask (see select_poi).
+#  - mean:
+#    Optional vector subtracted from the selected samples.
+#  - matrix:
+#    Optional matrix of size P x D, P the number of selected samples.
+#
+#  EXAMPLE:
+#
+#  projection = Projection(poi=select_poi(snr, 50))
+#  features = projection(traces)
+
+
+class Projection:
+
+	def __init__(self, poi=None, mean=None, matrix=None):
+		if poi is not None and np.asarray(poi).dtype == np.bool_:
+			poi = np.flatnonzero(poi)
+		self.poi = poi
+		self.mean = mean
+		self.matrix = matrix
+
+	def __call__(self, traces):
+		traces = np.asarray(traces)
+		if self.poi is not None:
+			traces = traces[:, self.poi]
+		traces = np.double(traces)
+		if self.mean is not None:
+			traces = traces - self.mean
+		if self.matrix is not None:
+			traces = np.dot(traces, self.matrix)
+		return traces
+
+	def then(self, matrix):
+		#  this projection followed by a second matrix
+		if self.matrix is None:
+			return Projection(self.poi, self.mean, matrix)
+		return Projection(self.poi, self.mean, np.dot(self.matrix, matrix))
+
+
+def _shift_second_moments(count, sum_x, sum_xs, left, right, d):
+	#  the sums of y = x - offset, sum_xs = left^T (sum y y^T) right, rewritten
+	#  for x - (offset - d) = y + d; None stands for the identity
+	def apply(v, matrix):
+		return v if matrix is None else np.dot(v, matrix)
+	sum_xs = sum_xs + np.outer(apply(d, left), apply(sum_x, right)) + np.outer(apply(sum_x, left), apply(d, right)) \
+		+ count * np.outer(apply(d, left), apply(d, right))
+	return sum_x + count * d, sum_xs
+
+# class PcaAccumulator(components, oversample, seed, sketch, basis)
+
+#  streaming principal component analysis of traces
+#
+#  DESCRIPTION:
+#
+#  acc = PcaAccumulator(components, oversample, seed, sketch, basis)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  [projection, variance] = acc.projection()
+#  refined = acc.refined()
+#
+#  finds the directions of largest variance of the traces in one pass.
+#  For traces of up to PCA_COVARIANCE_SAMPLES samples the T x T covariance
+#  matrix is accumulated and diagonalized. Longer traces are sketched: only
+#  the product of the covariance with a fixed random T x L matrix (L =
+#  components + oversample) is accumulated, X^T (X Omega), and the
+#  components are recovered from the sketch by the single-pass Nystrom
+#  approximation of a positive semi-definite matrix (Tropp et al.), so the
+#  covariance is never formed. The sums are those of the traces minus the
+#  mean of the first chunk, and merge() rebases the sums of other workers,
+#  which must use the same 'seed'.
+#
+#  The sketch finds the leading subspace well, but its variances are
+#  biased when the noise spreads over many samples. refined() returns an
+#  accumulator for an optional second pass that restricts the covariance
+#  to the L sketched directions ('basis'): its projection() has the exact
+#  variances and the best components in that subspace.
+#
+#  PARAMETERS:
+#
+#  - components:
+#    The number of principal components (default 10).
+#  - oversample:
+#    Extra sketch columns, more is more accurate (default 10).
+#  - seed:
+#    The seed of the random sketch matrix.
+#  - sketch:
+#    True / False to force the sketch / the full covariance (default: by
+#    trace length).
+#  - basis:
+#    Optional T x L matrix with orthonormal columns; only the covariance
+#    in this subspace is accumulated (see refined()).
+#
+#  RETURNVALUES:
+#
+#  - projection:
+#    A Projection onto the components, (traces - mean) @ W with W of size
+#    T x components.
+#  - variance:
+#    The variance along each component, in decreasing order.
+#
+#  EXAMPLE:
+#
+#  acc = accumulate(PcaAccumulator(20), trace_chunks('capture'))
+#  acc = accumulate(acc.refined(), trace_chunks('capture'))
+#  [projection, variance] = acc.projection()
+#  features = projection(traces)
+
+PCA_COVARIANCE_SAMPLES = 4096
+
+
+class PcaAccumulator:
+
+	def __init__(self, components=10, oversample=10, seed=0, sketch=None, basis=None):
+		self.components = components
+		self.oversample = oversample
+		self.seed = seed
+		self.sketch = sketch
+		self.basis = basis
+		self.reset()
+
+	def reset(self):
+		#  the sums become arrays on the first update; the samples are
+		#  summed relative to 'offset', the mean of the first chunk
+		self.count = 0
+		self.offset = None
+		self.omega = None
+		self.sum_x = 0.0
+		self.sum_xs = 0.0
+		return self
+
+	def _start(self, trace_length):
+		if self.basis is not None:
+			return
+		sketch = self.sketch
+		if sketch is None:
+			sketch = trace_length > PCA_COVARIANCE_SAMPLES
+		if sketch:
+			rng = np.random.default_rng(self.seed)
+			self.omega = rng.standard_normal((trace_length, self.components + self.oversample))
+
+	def update(self, traces, inputs=None):
+		traces = np.asarray(traces)
+		if self.offset is None:
+			self.offset = np.mean(traces, axis=0, dtype=np.float64)
+			self._start(np.shape(traces)[1])
+
+		y = np.double(traces) - self.offset
+		self.count += np.shape(y)[0]
+		self.sum_x = self.sum_x + np.sum(y, axis=0)
+		if self.basis is not None:
+			y_basis = np.dot(y, self.basis)
+			self.sum_xs = self.sum_xs + np.dot(y_basis.T, y_basis)
+		else:
+			self.sum_xs = self.sum_xs + np.dot(y.T, y if self.omega is None else np.dot(y, self.omega))
+		return self
+
+	def merge(self, other):
+		if other.count == 0:
+			return self
+		if self.offset is None:
+			self.offset = other.offset
+			self.omega = other.omega
+		right = self.omega if self.basis is None else self.basis
+		sum_x, sum_xs = _shift_second_moments(
+			other.count, other.sum_x, other.sum_xs, self.basis, right, other.offset - self.offset)
+		self.count += other.count
+		self.sum_x = self.sum_x + sum_x
+		self.sum_xs = self.sum_xs + sum_xs
+		return self
+
+	def projection(self):
+		n = self.count
+		mean = self.sum_x / n
+		if self.basis is not None:
+			mean_basis = np.dot(mean, self.basis)
+			covariance = (self.sum_xs - n * np.outer(mean_basis, mean_basis)) / n
+			variance, vectors = np.linalg.eigh(covariance)
+			vectors = np.dot(self.basis, vectors)
+		elif self.omega is None:
+			covariance = (self.sum_xs - n * np.outer(mean, mean)) / n
+			variance, vectors = np.linalg.eigh(covariance)
+		else:
+			#  Y = C Omega, and C ~ Y (Omega^T Y)^-1 Y^T, with a small shift
+			#  nu that keeps Omega^T Y positive definite
+			y = (self.sum_xs - n * np.outer(mean, np.dot(mean, self.omega))) / n
+			nu = np.sqrt(np.shape(y)[0]) * np.finfo(float).eps * np.linalg.norm(y)
+			y = y + nu * self.omega
+			b = np.dot(self.omega.T, y)
+			c = np.linalg.cholesky((b + b.T) / 2)
+			e = np.linalg.solve(c, y.T).T
+			vectors, sigma, _ = np.linalg.svd(e, full_matrices=False)
+			variance = np.maximum(sigma ** 2 - nu, 0)
+
+		order = np.argsort(variance)[::-1][:self.components]
+		return Projection(mean=self.offset + mean, matrix=vectors[:, order]), variance[order]
+
+	def refined(self):
+		#  an accumulator for a second pass in the subspace of the sketch
+		n = self.count
+		mean = self.sum_x / n
+		if self.omega is None:
+			sketch = self.projection()[0].matrix
+		else:
+			sketch = (self.sum_xs - n * np.outer(mean, np.dot(mean, self.omega))) / n
+		basis = np.linalg.qr(sketch)[0]
+		return PcaAccumulator(self.components, self.oversample, self.seed, self.sketch, basis)
+
+# class LdaAccumulator(classes, label, reduction)
+
+#  streaming linear discriminant analysis of labelled traces
+#
+#  DESCRIPTION:
+#
+#  acc = LdaAccumulator(classes, label, reduction)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  [projection, separation] = acc.projection(components)
+#
+#  finds the directions that best separate the classes of a known
+#  intermediate (e.g. a byte of the state of aes_crypt_8bit_and_leak under
+#  the known key): the generalized eigenvectors of the between-class and
+#  within-class scatter matrices. The traces are first reduced to D
+#  features by 'reduction' (points of interest or a PCA projection) and
+#  the count and sum of every class and the D x D sum of squares are
+#  accumulated in one pass, so the T x T scatter matrices are never
+#  formed.
+#
+#  PARAMETERS:
+#
+#  - classes:
+#    The number of classes (default 256).
+#  - label:
+#    Optional function mapping a chunk of inputs to the vector of class
+#    labels, as for SnrAccumulator.
+#  - reduction:
+#    A Projection applied to every chunk first, e.g. Projection(poi) or
+#    the projection of a PcaAccumulator (default: all the samples).
+#
+#  RETURNVALUES:
+#
+#  - projection:
+#    A Projection of the traces onto the discriminant components,
+#    'reduction' followed by the D x components LDA matrix.
+#  - separation:
+#    The ratio of between-class to within-class variance along each
+#    component, in decreasing order.
+#
+#  EXAMPLE:
+#
+#  def sbox_out_3(inputs):
+#      return aes_crypt_partial(inputs, key, 1, 'B1')[:, 3]
+#
+#  pca = accumulate(PcaAccumulator(50), trace_chunks('profiling')).projection()[0]
+#  lda = accumulate(LdaAccumulator(256, sbox_out_3, pca), trace_chunks('profiling'))
+#  [projection, separation] = lda.projection(9)
+
+
+class LdaAccumulator:
+
+	def __init__(self, classes=256, label=None, reduction=None):
+		self.classes = classes
+		self.label = label
+		self.reduction = reduction if reduction is not None else Projection()
+		self.reset()
+
+	def reset(self):
+		#  the sums become arrays on the first update; the features are
+		#  summed relative to 'offset', the mean of the first chunk
+		self.offset = None
+		self.count = np.zeros(self.classes, dtype=np.int64)
+		self.sum_c = 0.0
+		self.sum_xx = 0.0
+		return self
+
+	def update(self, traces, inputs):
+		x = self.reduction(traces)
+		labels = np.ravel(self.label(inputs) if self.label is not None else inputs).astype(np.intp)
+		if self.offset is None:
+			self.offset = np.mean(x, axis=0)
+
+		y = x - self.offset
+		one_hot = np.double(np.arange(self.classes)[:, np.newaxis] == labels)
+		self.count += np.bincount(labels, minlength=self.classes)
+		self.sum_c = self.sum_c + np.dot(one_hot, y)
+		self.sum_xx = self.sum_xx + np.dot(y.T, y)
+		return self
+
+	def merge(self, other):
+		if np.sum(other.count) == 0:
+			return self
+		if self.offset is None:
+			self.offset = other.offset
+		d = other.offset - self.offset
+		_, sum_xx = _shift_second_moments(np.sum(other.count), np.sum(other.sum_c, axis=0), other.sum_xx, None, None, d)
+		self.count += other.count
+		self.sum_c = self.sum_c + other.sum_c + np.outer(other.count, d)
+		self.sum_xx = self.sum_xx + sum_xx
+		return self
+
+	def projection(self, components=None):
+		present = self.count > 0
+		count = self.count[present]
+		means = self.sum_c[present] / count[:, np.newaxis]
+		total = np.sum(count)
+		mean = np.dot(count, means) / total
+
+		#  within-class scatter: all the squares minus those of the class
+		#  means; between-class scatter: the squares of the class means
+		centered = means - mean
+		between = np.dot(centered.T * count, centered)
+		within = self.sum_xx - np.dot(means.T * count, means)
+		dimension = np.shape(within)[0]
+		within = within + np.eye(dimension) * (1e-10 * np.trace(within) / dimension)
+
+		#  whiten the within-class scatter and diagonalize the rest
+		c = np.linalg.cholesky(within)
+		m = np.linalg.solve(c, np.linalg.solve(c, between).T)
+		separation, vectors = np.linalg.eigh((m + m.T) / 2)
+		order = np.argsort(separation)[::-1][:components or min(np.sum(present) - 1, dimension)]
+		matrix = np.linalg.solve(c.T, vectors[:, order])
+		return self.reduction.then(matrix), separation[order]
+
+# class TemplateAccumulator(classes, label, reduction)
+
+#  streaming construction of Gaussian templates with a pooled covariance
+#
+#  DESCRIPTION:
+#
+#  acc = TemplateAccumulator(classes, label, reduction)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  templates = acc.templates()
+#
+#  profiles the points of interest of labelled traces in one pass: the
+#  count and sum of every class and the D x D sum of squares of the
+#  features are accumulated as for LdaAccumulator, from which templates()
+#  takes the mean of every class and the covariance pooled over all the
+#  classes (the within-class scatter over N - classes).
+#
+#  PARAMETERS:
+#
+#  - classes, label, reduction:
+#    As for LdaAccumulator; 'reduction' is typically Projection(poi) with
+#    ~20 points of interest from select_poi.
+#
+#  RETURNVALUES:
+#
+#  - templates:
+#    The Templates of the classes.
+#
+#  EXAMPLE:
+#
+#  def sbox_out_3(inputs):
+#      return aes_crypt_partial(inputs, key, 1, 'B1')[:, 3]
+#
+#  acc = accumulate(TemplateAccumulator(256, sbox_out_3, Projection(poi)), trace_chunks('profiling'))
+#  templates = acc.templates()
+
+
+class TemplateAccumulator(LdaAccumulator):
+
+	def templates(self):
+		present = self.count > 0
+		count = self.count[present]
+		means = self.sum_c[present] / count[:, np.newaxis]
+		within = self.sum_xx - np.dot(means.T * count, means)
+		covariance = within / max(np.sum(count) - np.size(count), 1)
+
+		all_means = np.full(np.shape(self.sum_c), np.nan)
+		all_means[present] = means + self.offset
+		return Templates(self.reduction, all_means, covariance)
+
+# class Templates(reduction, means, covariance)
+
+#  Gaussian templates sharing one covariance matrix
+#
+#  DESCRIPTION:
+#
+#  templates = Templates(reduction, means, covariance)
+#  log_likelihood = templates.log_likelihood(traces)
+#
+#  scores traces against the template of every class. The covariance is
+#  factored once, C = L L^T, and the features and the class means are
+#  whitened by L^-1, so that the squared Mahalanobis distances of a chunk
+#  of traces to all the classes come from one matrix product:
+#
+#    (x - m)^T C^-1 (x - m) = |z|^2 - 2 z . w + |w|^2,  z = L^-1 x, w = L^-1 m.
+#
+#  PARAMETERS:
+#
+#  - reduction:
+#    The Projection from traces to the D features.
+#  - means:
+#    The class means, classes x D (NaN for a class never seen).
+#  - covariance:
+#    The pooled D x D covariance.
+#
+#  RETURNVALUES:
+#
+#  - log_likelihood:
+#    A matrix of size N x classes, the log-likelihood of every trace under
+#    every class, up to a constant shared by the classes (-inf for a class
+#    never seen).
+#
+#  EXAMPLE:
+#
+#  classes = np.argmax(templates.log_likelihood(traces), axis=1)
+
+
+class Templates:
+
+	def __init__(self, reduction, means, covariance):
+		dimension = np.shape(covariance)[0]
+		covariance = covariance + np.eye(dimension) * (1e-10 * np.trace(covariance) / dimension)
+		whitening = np.linalg.inv(np.linalg.cholesky(covariance)).T
+
+		self.means = means
+		self.covariance = covariance
+		self.projection = reduction.then(whitening)
+		present = ~np.isnan(means[:, 0])
+		self.whitened = np.dot(np.where(present[:, np.newaxis], means, 0), whitening)
+		self.bias = np.where(present, -0.5 * np.sum(self.whitened ** 2, axis=1), -np.inf)
+
+	def log_likelihood(self, traces):
+		z = self.projection(traces)
+		result = np.dot(z, self.whitened.T)
+		result += self.bias
+		result -= 0.5 * np.einsum('ij,ij->i', z, z)[:, np.newaxis]
+		return result
+
+# class TemplateAttack(templates, byte, state, hypothesis)
+
+#  template attack of a key byte, accumulated over chunks of traces
+#
+#  DESCRIPTION:
+#
+#  acc = TemplateAttack(templates, byte, state, hypothesis)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  scores = acc.scores()
+#  rank = acc.rank(key)
+#
+#  adds, for every key guess, the log-likelihood of each attack trace
+#  under the class the guess predicts for it. By default the classes are
+#  the values of byte 'byte' of 'state' (see aes_state_guesses) for the
+#  guesses of the key byte it depends on (see aes_guessed_key_byte), e.g.
+#  the round 1 S-box outputs the templates were built on. The
+#  log-likelihoods of a chunk are computed once for all the classes and
+#  then gathered for the 256 guesses.
+#
+#  PARAMETERS:
+#
+#  - templates:
+#    The Templates of the classes.
+#  - byte:
+#    The byte of the state the templates classify (0..15).
+#  - state:
+#    The state the templates classify (default 'B1').
+#  - hypothesis:
+#    Optional function mapping a chunk of inputs to the N x G matrix of the
+#    class under every guess, replacing aes_state_guesses.
+#
+#  RETURNVALUES:
+#
+#  - scores:
+#    The summed log-likelihood of every key guess.
+#  - rank:
+#    The number of guesses scoring better than 'key', the value of key
+#    byte aes_guessed_key_byte(state, byte) (0 = recovered).
+#
+#  EXAMPLE:
+#
+#  acc = accumulate(TemplateAttack(templates, 3), trace_chunks('attack', 1000))
+#  key_guess = np.argmax(acc.scores())
+
+
+class TemplateAttack:
+
+	def __init__(self, templates, byte=0, state='B1', hypothesis=None):
+		self.templates = templates
+		self.byte = byte
+		self.state = state
+		self.hypothesis = hypothesis
+		self.reset()
+
+	def reset(self):
+		self.count = 0
+		self.score = 0.0
+		return self
+
+	def _classes(self, inputs):
+		if self.hypothesis is not None:
+			return self.hypothesis(inputs)
+		return aes_state_guesses(inputs, self.state, self.byte)
+
+	def update(self, traces, inputs):
+		log_likelihood = self.templates.log_likelihood(traces)
+		count, classes = np.shape(log_likelihood)
+		#  flat indices of log_likelihood[n, class of n under every guess]
+		index = np.asarray(self._classes(inputs)) + (np.arange(count) * classes)[:, np.newaxis]
+		self.count += count
+		self.score = self.score + np.sum(np.take(log_likelihood.ravel(), index), axis=0)
+		return self
+
+	def merge(self, other):
+		self.count += other.count
+		self.score = self.score + other.score
+		return self
+
+	def scores(self):
+		return self.score
+
+	def rank(self, key):
+		return int(np.sum(self.score > self.score[key]))
+
+# class RegressionAccumulator(label, bits, poi)
+
+#  streaming linear regression of traces on the bits of an intermediate
+#
+#  DESCRIPTION:
+#
+#  acc = RegressionAccumulator(label, bits, poi)
+#  acc.update(traces, inputs)
+#  acc.merge(other)
+#  acc.reset()
+#  coefficients = acc.coefficients()
+#  r_squared = acc.r_squared()
+#  leakage = acc.leakage_model(sample)
+#
+#  profiles the stochastic model of every sample: the sample is fitted as
+#  c_0 + c_1 b_0(v) + ... + c_8 b_7(v), b_i(v) the bits of the known
+#  intermediate v (e.g. an S-box output under the known key). The normal
+#  equations X^T X and X^T Y of the design matrix X = [1, bits] are summed
+#  chunk by chunk: it is a CpaAccumulator whose hypotheses are the bits
+#  (exact for integer traces), with the sums of the products of every pair
+#  of bits added. The fit takes one pass over any number of traces, and
+#  merge() combines the sums of parallel workers. correlation() gives the
+#  bits x T correlation of every bit with every sample.
+#
+#  PARAMETERS:
+#
+#  - label:
+#    Optional function mapping a chunk of inputs to the vector of
+#    intermediate values, as for SnrAccumulator.
+#  - bits:
+#    The number of bits of the intermediate (default 8).
+#  - poi:
+#    Optional points of interest, as for cpa.
+#
+#  RETURNVALUES:
+#
+#  - coefficients:
+#    A matrix of size (bits + 1) x T, the intercept then the weight of
+#    bit 0, 1, ... at every sample.
+#  - r_squared:
+#    The fraction of the variance of every sample explained by the model.
+#  - leakage_model:
+#    The predicted leakage of all the 2^bits values at 'sample' (a vector
+#    that replaces AES_SBOX_HW), or at every sample (2^bits x T).
+#
+#  EXAMPLE:
+#
+#  def sbox_out_3(inputs):
+#      return aes_crypt_partial(inputs, key, 1, 'B1')[:, 3]
+#
+#  acc = accumulate(RegressionAccumulator(sbox_out_3), trace_chunks('profiling'))
+#  peak = np.argmax(acc.r_squared())
+#  classification_output = cpa(traces, inputs, 3, acc.leakage_model(peak)[AES_SBOX])
+
+
+class RegressionAccumulator(CpaAccumulator):
+
+	def __init__(self, label=None, bits=8, poi=None):
+		self.label = label
+		self.bits = bits
+		CpaAccumulator.__init__(self, None, None, None, poi)
+
+	def reset(self):
+		CpaAccumulator.reset(self)
+		self.sum_hh = 0
+		return self
+
+	def _bits(self, values):
+		return np.uint8((np.ravel(values).astype(np.int64)[:, np.newaxis] >> np.arange(self.bits)) & 1)
+
+	def _hypotheses(self, inputs):
+		return self._bits(self.label(inputs) if self.label is not None else inputs)
+
+	def _update(self, traces, hypothesis):
+		self.sum_hh = self.sum_hh + np.dot(hypothesis.T.astype(np.int64), hypothesis)
+		return CpaAccumulator._update(self, traces, hypothesis)
+
+	def merge(self, other):
+		if other.count == 0:
+			return self
+		self.sum_hh = self.sum_hh + other.sum_hh
+		return CpaAccumulator.merge(self, other)
+
+	def _reshape(self, result):
+		return result
+
+	def _normal_equations(self):
+		xtx = np.empty([self.bits + 1, self.bits + 1])
+		xtx[0, 0] = self.count
+		xtx[0, 1:] = xtx[1:, 0] = self.sum_h
+		xtx[1:, 1:] = self.sum_hh
+		xty = np.vstack([self.sum_x, self.sum_hx])
+		return xtx, xty
+
+	def _solve(self):
+		#  least squares, so that a bit that never changes gets weight 0
+		xtx, xty = self._normal_equations()
+		return np.linalg.lstsq(xtx, xty, rcond=None)[0], xty
+
+	def coefficients(self):
+		beta = self._solve()[0]
+		beta[0] += self.offset
+		return beta
+
+	def r_squared(self):
+		beta, xty = self._solve()
+		residual = self.sum_x2 - np.sum(beta * xty, axis=0)
+		total = self.sum_x2 - self.sum_x ** 2 / self.count
+		return np.divide(total - residual, total, out=np.zeros(np.shape(total)), where=total > 0)
+
+	def leakage_model(self, sample=None):
+		beta = self.coefficients()
+		if sample is not None:
+			beta = beta[:, sample]
+		values = np.arange(2 ** self.bits)
+		design = np.hstack([np.ones([np.size(values), 1]), self._bits(values)])
+		return np.dot(design, beta)
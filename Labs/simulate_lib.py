@@ -0,0 +1,297 @@
+import numpy as np
+from aes_lib import aes_crypt_8bit_record, aes_crypt_batch
+from hamming_weight import HW_TABLE_8
+from trace_lib import TraceStore, trace_store_create, TRACE_CHUNK_SIZE
+
+# function [traces, outputs] = simulate_traces(inputs, key, states, model, mixcolumns, pulse, noise, delay, jitter, dtype, seed)
+
+#  simulates the power traces of an 8-bit AES encryption
+#
+#  DESCRIPTION:
+#
+#  [traces, outputs] = simulate_traces(inputs, key, states, model, mixcolumns, pulse, noise, delay, jitter, dtype, seed)
+#
+#  records the leaking intermediates of all the inputs at once with
+#  aes_crypt_8bit_record and turns them into synthetic power traces. The
+#  device is modelled as processing one byte per operation, in the order
+#  of the state progression: the 16 bytes of every selected state one
+#  after the other, and (with 'mixcolumns') the 9 values of every 8-bit
+#  MixColumns column just before the MixColumns output state of the
+#  round. Every operation leaks model(value) and draws the samples of
+#  'pulse', scaled by that leakage; Gaussian noise is added to all the
+#  samples.
+#
+#  The leakage of an operation is one table lookup in a 256-entry table
+#  per model, so the cost is dominated by the AES itself and by drawing
+#  the noise.
+#
+#  PARAMETERS:
+#
+#  - inputs:
+#    A matrix of bytes of size N x 16, the plaintexts.
+#  - key:
+#    A vector of 16 bytes, the secret key.
+#  - states:
+#    The indices (0..40) of the states that leak, as for aes_state_index
+#    (default: all of them).
+#    P K BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRMK BRK(=C)
+#  - model:
+#    The leakage model, either for all intermediates or as a dictionary
+#    from the state index (or 'mixcolumns') to its model; intermediates
+#    missing from the dictionary leak 'hw'. A model is
+#      'hw'        the Hamming weight of the value,
+#      'hd'        the Hamming distance to the value it overwrites (the
+#                  same byte of the previous state, or the previous value
+#                  of the MixColumns column),
+#      'identity'  the value itself,
+#      or a vector of 8 weights, bit 0 first, summed over the set bits.
+#  - mixcolumns:
+#    Whether the intermediate values of the 8-bit MixColumns leak.
+#  - pulse:
+#    The samples drawn by one operation (default: a single sample).
+#  - noise:
+#    The standard deviation of the Gaussian noise.
+#  - delay:
+#    Largest random delay of a whole trace, in samples (trigger jitter).
+#  - jitter:
+#    Largest number of idle samples inserted at random before every
+#    operation (clock jitter); the misalignment grows along the trace.
+#  - dtype:
+#    The sample type; integer types are rounded and saturated.
+#  - seed:
+#    The seed (or np.random.Generator) of the noise and of the jitter.
+#
+#  RETURNVALUES:
+#
+#  - traces:
+#    A matrix of size N x T, T = operations * (len(pulse) + jitter) + delay.
+#  - outputs:
+#    The ciphertexts, N x 16.
+#
+#  EXAMPLE:
+#
+#  inputs = np.random.randint(0, 256, (1000, 16))
+#  [traces, outputs] = simulate_traces(inputs, range(16), states=[1, 2], noise=2.0)
+
+SIMULATION_STATES = 41
+
+_LEAK_BITS = np.float32((np.arange(256)[:, np.newaxis] >> np.arange(8)) & 1)
+
+
+def _leak_table(model):
+	if isinstance(model, str):
+		if model in ('hw', 'hd'):
+			return np.float32(HW_TABLE_8)
+		if model == 'identity':
+			return np.arange(256, dtype=np.float32)
+		raise ValueError('unknown leakage model %s' % model)
+	weights = np.asarray(model, dtype=np.float32)
+	if np.shape(weights) != (8,):
+		raise ValueError('a bit weight model has 8 weights, bit 0 first')
+	return _LEAK_BITS @ weights
+
+
+def _model_of(model, name):
+	if isinstance(model, dict):
+		return model.get(name, 'hw')
+	return model
+
+
+def _operations(states, mixcolumns):
+	#  ('state', index) and ('mixcolumns', round) blocks in time order; the
+	#  MixColumns values of round i are computed for state 4 + 4i
+	states = set(int(s) for s in states)
+	operations = []
+	for index in range(SIMULATION_STATES):
+		if mixcolumns and 4 <= index <= 36 and index % 4 == 0:
+			operations.append(('mixcolumns', (index - 4) // 4))
+		if index in states:
+			operations.append(('state', index))
+	return operations
+
+
+def _is_hd(spec):
+	return isinstance(spec, str) and spec == 'hd'
+
+
+def _record(operations, model):
+	#  the intermediates of aes_crypt_8bit_record the operations leak
+	record = {}
+	for kind, index in operations:
+		if kind == 'state':
+			record[index] = None
+			if _is_hd(_model_of(model, index)) and index > 0:
+				record[index - 1] = None
+		else:
+			record['MC%d' % (index + 1)] = None
+	return record
+
+
+def _leakage(records, operations, model):
+	blocks = []
+	for kind, index in operations:
+		if kind == 'state':
+			spec = _model_of(model, index)
+			values = records[index]
+			if _is_hd(spec) and index > 0:
+				values = values ^ records[index - 1]
+		else:
+			spec = _model_of(model, 'mixcolumns')
+			#  N x 4 x 9 -> N x 36, column after column
+			values = records['MC%d' % (index + 1)]
+			if _is_hd(spec):
+				previous = np.zeros_like(values)
+				previous[:, :, 1:] = values[:, :, :-1]
+				values = values ^ previous
+			values = values.reshape(np.shape(values)[0], np.prod(np.shape(values)[1:]))
+		blocks.append(_leak_table(spec)[values])
+	return np.concatenate(blocks, axis=1)
+
+
+def _layout(leakage, pulse, delay, jitter, rng):
+	count, operations = np.shape(leakage)
+	width = np.size(pulse)
+	if not delay and not jitter:
+		return (leakage[:, :, np.newaxis] * pulse).reshape(count, operations * width)
+
+	length = operations * (width + jitter) + delay
+	positions = np.arange(operations) * width + np.arange(count)[:, np.newaxis] * length
+	if jitter:
+		positions += np.cumsum(rng.integers(0, jitter + 1, (count, operations)), axis=1)
+	if delay:
+		positions += rng.integers(0, delay + 1, (count, 1))
+
+	traces = np.zeros((count, length), dtype=np.float32)
+	flat = traces.reshape(-1)
+	for p in range(width):
+		flat[positions + p] = leakage * pulse[p]
+	return traces
+
+
+def simulate_traces(inputs, key, states=range(SIMULATION_STATES), model='hw', mixcolumns=False, pulse=(1.0,), noise=1.0, delay=0, jitter=0, dtype=np.float32, seed=None):
+	rng = np.random.default_rng(seed)
+	operations = _operations(states, mixcolumns)
+	records = aes_crypt_8bit_record(inputs, key, 1, _record(operations, model))
+	outputs = aes_crypt_batch(inputs, key, 1)
+
+	leakage = _leakage(records, operations, model)
+	traces = _layout(leakage, np.float32(pulse), delay, jitter, rng)
+	if noise:
+		traces += np.float32(noise) * rng.standard_normal(np.shape(traces), dtype=np.float32)
+
+	if np.issubdtype(dtype, np.integer):
+		info = np.iinfo(dtype)
+		traces = np.clip(np.rint(traces), info.min, info.max)
+	return traces.astype(dtype, copy=False), outputs
+
+# function [samples] = simulated_samples(states, mixcolumns, pulse)
+
+#  locates the leakage of the states in the simulated traces
+#
+#  DESCRIPTION:
+#
+#  samples = simulated_samples(states, mixcolumns, pulse)
+#
+#  returns the first sample of every state byte in the traces of
+#  simulate_traces without delay or jitter, e.g. as the known points of
+#  interest of a benchmark.
+#
+#  RETURNVALUES:
+#
+#  - samples:
+#    A matrix of size |states| x 16, in the order of the state
+#    progression.
+#
+#  EXAMPLE:
+#
+#  poi = simulated_samples([1, 2])[1]   # the 16 S-box outputs of round 1
+
+
+def simulated_samples(states=range(SIMULATION_STATES), mixcolumns=False, pulse=(1.0,)):
+	samples = []
+	start = 0
+	for kind, _ in _operations(states, mixcolumns):
+		if kind == 'state':
+			samples.append(start + np.arange(16) * np.size(pulse))
+			start += 16 * np.size(pulse)
+		else:
+			start += 36 * np.size(pulse)
+	return np.array(samples, dtype=np.intp).reshape(-1, 16)
+
+# function [chunks] = simulate_chunks(count, key, chunk_size, seed, **options)
+
+#  generates a synthetic trace set chunk by chunk
+#
+#  DESCRIPTION:
+#
+#  for traces, inputs in simulate_chunks(count, key, chunk_size, seed, **options):
+#
+#  yields (traces, inputs) chunks of 'count' simulated traces with random
+#  plaintexts, so that it can be used as the source of trace_chunks or
+#  accumulate without ever holding the whole set in memory. Every chunk
+#  has its own random stream derived from 'seed', so a set is reproduced
+#  exactly by the same seed and chunk size. The options are those of
+#  simulate_traces.
+#
+#  EXAMPLE:
+#
+#  acc = accumulate(CpaAccumulator(range(16)), simulate_chunks(10**6, range(16), states=[2], noise=4.0))
+
+
+def _simulate_chunks(count, key, chunk_size, seed, options):
+	starts = range(0, count, chunk_size)
+	for start, sequence in zip(starts, np.random.SeedSequence(seed).spawn(len(starts))):
+		rng = np.random.default_rng(sequence)
+		inputs = rng.integers(0, 256, (min(chunk_size, count - start), 16), dtype=np.uint8)
+		traces, outputs = simulate_traces(inputs, key, seed=rng, **options)
+		yield traces, inputs, outputs
+
+
+def simulate_chunks(count, key, chunk_size=TRACE_CHUNK_SIZE, seed=0, **options):
+	for traces, inputs, _ in _simulate_chunks(count, key, chunk_size, seed, options):
+		yield traces, inputs
+
+# function [store] = simulate_store(path, count, key, chunk_size, seed, sampling, **options)
+
+#  writes a synthetic trace set into a trace store
+#
+#  DESCRIPTION:
+#
+#  store = simulate_store(path, count, key, chunk_size, seed, sampling, **options)
+#
+#  streams the chunks of simulate_chunks into a new trace store with the
+#  inputs, outputs and key sidecars of WS2, so that the attacks can be
+#  benchmarked on campaigns of millions of traces. The traces and the
+#  inputs and outputs are written chunk by chunk, only one chunk is in
+#  memory at a time. A 'count' of 0 gives an empty store.
+#
+#  RETURNVALUES:
+#
+#  - store:
+#    The new TraceStore, opened read only.
+#
+#  EXAMPLE:
+#
+#  store = simulate_store('SIM', 10**6, range(16), states=[1, 2], noise=2.0, dtype=np.int8)
+
+
+def simulate_store(path, count, key, chunk_size=TRACE_CHUNK_SIZE, seed=0, sampling=None, **options):
+	#  the trace length and type come from an empty simulation
+	traces, _ = simulate_traces(np.zeros((0, 16), dtype=np.uint8), key, **options)
+	store = trace_store_create(path, (count, np.shape(traces)[1]), traces.dtype, sampling, key=np.uint8(key))
+	all_inputs = store.create_sidecar('inputs', (count, 16), np.uint8)
+	all_outputs = store.create_sidecar('outputs', (count, 16), np.uint8)
+
+	start = 0
+	for traces, inputs, outputs in _simulate_chunks(count, key, chunk_size, seed, options):
+		rows = slice(start, start + np.shape(traces)[0])
+		store.traces[rows] = traces
+		all_inputs[rows] = inputs
+		all_outputs[rows] = outputs
+		start = rows.stop
+
+	all_inputs.flush()
+	all_outputs.flush()
+	store.flush()
+	del store, all_inputs, all_outputs
+	return TraceStore(path)
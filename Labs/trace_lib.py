@@ -0,0 +1,408 @@
+import json
+import os
+import queue
+import sys
+import threading
+import numpy as np
+
+# class TraceStore(path, mode)
+
+#  a memory-mapped set of power traces on disk
+#
+#  DESCRIPTION:
+#
+#  store = TraceStore(path, mode)
+#
+#  opens the trace store in the folder 'path'. A trace store is made of
+#
+#    header.json   dtype and shape of the traces, sampling information and
+#                  the names of the sidecar arrays
+#    traces.bin    the N x T trace matrix as raw little-endian samples,
+#                  one trace after the other
+#    <name>.npy    one file per sidecar array (inputs, outputs, key, ...)
+#
+#  Opening reads only the header; the traces and the sidecars are mapped
+#  with np.memmap, so slicing a window such as store['traces'][:, 0:30000]
+#  only pages in the bytes of that window. store[name] works like the
+#  dictionary returned by scipy.io.loadmat. store.create_sidecar(name,
+#  shape, dtype) maps a new zero-filled sidecar for writing, so that large
+#  sidecars can be filled chunk by chunk like the traces.
+#
+#  PARAMETERS:
+#
+#  - path:
+#    The folder of the trace store.
+#  - mode:
+#    np.memmap mode, 'r' (read only, default) or 'r+' (read and write).
+#
+#  EXAMPLE:
+#
+#  ws2 = TraceStore('WS2')
+#  traces = ws2['traces'][:, 0:30000]
+#  inputs = ws2['inputs']
+
+TRACE_STORE_HEADER = 'header.json'
+TRACE_STORE_TRACES = 'traces.bin'
+
+
+class TraceStore:
+
+	def __init__(self, path, mode='r'):
+		self.path = path
+		self.mode = mode
+		with open(os.path.join(path, TRACE_STORE_HEADER)) as f:
+			self.header = json.load(f)
+
+		shape = tuple(self.header['shape'])
+		self.traces = np.memmap(
+			os.path.join(path, TRACE_STORE_TRACES), dtype=np.dtype(self.header['dtype']), mode=mode, shape=shape)
+
+	@property
+	def shape(self):
+		return np.shape(self.traces)
+
+	@property
+	def sampling(self):
+		return self.header.get('sampling', {})
+
+	def keys(self):
+		return ['traces'] + list(self.header['sidecars'])
+
+	def __contains__(self, name):
+		return name in self.keys()
+
+	def __getitem__(self, name):
+		if name == 'traces':
+			return self.traces
+		if name not in self.header['sidecars']:
+			raise KeyError(name)
+		return np.load(os.path.join(self.path, name + '.npy'), mmap_mode=self.mode)
+
+	def __setitem__(self, name, value):
+		if name == 'traces':
+			raise KeyError('the traces of a store are written through store.traces')
+		np.save(os.path.join(self.path, name + '.npy'), np.asarray(value))
+		self._add_sidecar(name)
+
+	def create_sidecar(self, name, shape, dtype):
+		sidecar = np.lib.format.open_memmap(os.path.join(self.path, name + '.npy'), 'w+', dtype, tuple(shape))
+		self._add_sidecar(name)
+		return sidecar
+
+	def _add_sidecar(self, name):
+		if name not in self.header['sidecars']:
+			self.header['sidecars'].append(name)
+			_write_header(self.path, self.header)
+
+	def flush(self):
+		if self.mode != 'r':
+			self.traces.flush()
+
+
+def _write_header(path, header):
+	with open(os.path.join(path, TRACE_STORE_HEADER), 'w') as f:
+		json.dump(header, f, indent=1)
+
+# function [store] = trace_store_create(path, shape, dtype, sampling, **sidecars)
+
+#  creates an empty trace store
+#
+#  DESCRIPTION:
+#
+#  trace_store_create(path, shape, dtype, sampling, inputs=..., ...)
+#
+#  creates the folder 'path' with a header and a zero-filled trace file of
+#  the given shape, saves the given sidecar arrays, and returns the store
+#  opened for writing. The traces are then filled chunk by chunk through
+#  store.traces.
+#
+#  PARAMETERS:
+#
+#  - path:
+#    The folder of the new trace store.
+#  - shape:
+#    (N, T), the number of traces and the number of samples per trace.
+#  - dtype:
+#    The sample type, e.g. np.int8, np.int16, np.float32 (default
+#    np.float64). It is stored little-endian.
+#  - sampling:
+#    Optional dictionary of sampling information saved in the header, e.g.
+#    {'rate': 500e6, 'offset': 0}.
+#  - sidecars:
+#    Arrays stored next to the traces, e.g. inputs=..., outputs=...
+#
+#  RETURNVALUES:
+#
+#  - store:
+#    The new TraceStore, opened with mode 'r+'.
+#
+#  EXAMPLE:
+#
+#  store = trace_store_create('capture', (10**6, 100000), np.int8, inputs=inputs)
+
+
+def trace_store_create(path, shape, dtype=np.float64, sampling=None, **sidecars):
+	os.makedirs(path, exist_ok=True)
+	header = {
+		'dtype': np.dtype(dtype).newbyteorder('<').str,
+		'shape': [int(n) for n in shape],
+		'sampling': sampling or {},
+		'sidecars': [],
+	}
+	_write_header(path, header)
+
+	#  the trace file is created sparse at its full size
+	traces = np.memmap(os.path.join(path, TRACE_STORE_TRACES), dtype=np.dtype(header['dtype']), mode='w+', shape=tuple(header['shape']))
+	del traces
+
+	store = TraceStore(path, 'r+')
+	for name, value in sidecars.items():
+		store[name] = value
+	return store
+
+# function [store] = trace_store_from_mat(mat_path, path, dtype, sampling, chunk_size)
+
+#  converts a .mat trace set (like WS2.mat) into a trace store
+#
+#  DESCRIPTION:
+#
+#  trace_store_from_mat(mat_path, path, dtype, sampling, chunk_size)
+#
+#  loads 'mat_path' with scipy.io.loadmat, writes its 'traces' matrix into
+#  a new trace store and every other variable (inputs, outputs, key, ...)
+#  as a sidecar.
+#
+#  PARAMETERS:
+#
+#  - mat_path:
+#    The .mat file, with the traces in the variable 'traces'.
+#  - path:
+#    The folder of the new trace store.
+#  - dtype:
+#    The sample type of the store (default: the type in the .mat file);
+#    samples that do not fit an integer type are rounded and saturated.
+#  - sampling:
+#    As for trace_store_create.
+#  - chunk_size:
+#    Number of traces copied at a time.
+#
+#  RETURNVALUES:
+#
+#  - store:
+#    The new TraceStore, opened read only.
+#
+#  EXAMPLE:
+#
+#  ws2 = trace_store_from_mat('WS2.mat', 'WS2')
+
+
+def trace_store_from_mat(mat_path, path, dtype=None, sampling=None, chunk_size=10000):
+	import scipy.io as sp
+
+	mat = sp.loadmat(mat_path)
+	traces = mat.pop('traces')
+	sidecars = {name: value for name, value in mat.items() if not name.startswith('__')}
+
+	if dtype is None:
+		dtype = traces.dtype
+	store = trace_store_create(path, np.shape(traces), dtype, sampling, **sidecars)
+	#  a narrowing conversion would wrap and truncate the samples
+	saturate = np.issubdtype(dtype, np.integer) and not np.can_cast(traces.dtype, dtype)
+	for start in range(0, np.shape(traces)[0], chunk_size):
+		chunk = traces[start:start + chunk_size]
+		if saturate:
+			info = np.iinfo(dtype)
+			chunk = np.clip(np.rint(chunk), info.min, info.max)
+		store.traces[start:start + chunk_size] = chunk
+	store.flush()
+	del store
+
+	return TraceStore(path)
+
+# function [chunks] = trace_chunks(source, chunk_size, window, subset, inputs, prefetch)
+
+#  iterates over a trace set in chunks of traces
+#
+#  DESCRIPTION:
+#
+#  for traces, inputs in trace_chunks(source, chunk_size, window, subset, inputs, prefetch):
+#
+#  yields (traces_chunk, inputs_chunk) pairs of at most 'chunk_size'
+#  traces, so that any analysis can run over a campaign of any size with a
+#  fixed memory ceiling. Every chunk is a fresh in-memory array. With
+#  'prefetch' the next chunk is read on a background thread while the
+#  current one is being processed.
+#
+#  PARAMETERS:
+#
+#  - source:
+#    Where the traces come from:
+#      a TraceStore or the folder of one,
+#      a .mat file (loaded with scipy.io.loadmat) or the dictionary
+#      returned by loadmat,
+#      a .npy file of traces (memory-mapped), with 'inputs' an array or
+#      a .npy file,
+#      a (traces, inputs) pair of arrays,
+#      or any other iterable of (traces, inputs) chunks, e.g. a synthetic
+#      trace generator; its chunks are passed through as they are
+#      ('chunk_size' and 'subset' do not apply).
+#  - chunk_size:
+#    Number of traces per chunk.
+#  - window:
+#    Optional (start, stop) sample window, e.g. (0, 30000).
+#  - subset:
+#    Optional selection of traces: a slice, a boolean mask or a vector of
+#    trace indices.
+#  - inputs:
+#    The name of the inputs variable of a store / .mat file (default
+#    'inputs'), or the inputs themselves for a .npy source. The inputs
+#    chunk is None when there are no inputs.
+#  - prefetch:
+#    Number of chunks read ahead on a background thread (0 disables it).
+#
+#  EXAMPLE:
+#
+#  acc = CpaAccumulator(11)
+#  for traces, inputs in trace_chunks('WS2', 50, window=(0, 30000)):
+#      acc.update(traces, inputs)
+
+TRACE_CHUNK_SIZE = 10000
+
+
+def _open_traces(source, inputs):
+	if isinstance(source, str):
+		if os.path.isdir(source):
+			source = TraceStore(source)
+		elif source.endswith('.mat'):
+			import scipy.io as sp
+			source = sp.loadmat(source)
+		elif source.endswith('.npy'):
+			if isinstance(inputs, str):
+				inputs = np.load(inputs, mmap_mode='r') if inputs.endswith('.npy') else None
+			return np.load(source, mmap_mode='r'), inputs
+		else:
+			raise ValueError('unknown trace source %s' % source)
+
+	if isinstance(source, tuple):
+		return source
+	if isinstance(inputs, str):
+		inputs = source[inputs] if inputs in source else None
+	return source['traces'], inputs
+
+
+def _read_chunks(traces, inputs, chunk_size, window, subset):
+	columns = slice(None) if window is None else slice(*window)
+	count = np.shape(traces)[0]
+
+	if subset is None:
+		subset = slice(None)
+	if isinstance(subset, slice) and subset.step in (None, 1):
+		#  contiguous blocks of lines are read with plain slices
+		first, last = subset.indices(count)[:2]
+		for start in range(first, last, chunk_size):
+			rows = slice(start, min(start + chunk_size, last))
+			yield np.array(traces[rows, columns]), None if inputs is None else np.array(inputs[rows])
+		return
+
+	if isinstance(subset, slice):
+		subset = np.arange(count)[subset]
+	subset = np.asarray(subset)
+	if subset.dtype == np.bool_:
+		subset = np.flatnonzero(subset)
+	for start in range(0, np.size(subset), chunk_size):
+		rows = subset[start:start + chunk_size]
+		yield np.array(traces[rows, columns]), None if inputs is None else np.array(inputs[rows])
+
+
+def _window_chunks(chunks, window):
+	for traces, inputs in chunks:
+		if window is not None:
+			traces = traces[:, window[0]:window[1]]
+		yield traces, inputs
+
+
+def _prefetch_chunks(chunks, depth):
+	#  a reader thread fills a bounded queue; it stops when the consumer
+	#  stops iterating
+	buffer = queue.Queue(maxsize=depth)
+	stop = threading.Event()
+	done = object()
+
+	def put(item):
+		#  False once the consumer has stopped, a full queue is never drained
+		while not stop.is_set():
+			try:
+				buffer.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				pass
+		return False
+
+	def reader():
+		try:
+			for chunk in chunks:
+				if not put(chunk):
+					return
+			put(done)
+		except BaseException as error:
+			put(error)
+
+	thread = threading.Thread(target=reader, daemon=True)
+	thread.start()
+	try:
+		while True:
+			chunk = buffer.get()
+			if chunk is done:
+				return
+			if isinstance(chunk, BaseException):
+				raise chunk
+			yield chunk
+	finally:
+		stop.set()
+
+
+def trace_chunks(source, chunk_size=TRACE_CHUNK_SIZE, window=None, subset=None, inputs='inputs', prefetch=1):
+	if isinstance(source, (str, tuple, TraceStore, dict)):
+		traces, inputs = _open_traces(source, inputs)
+		chunks = _read_chunks(traces, inputs, chunk_size, window, subset)
+	else:
+		chunks = _window_chunks(source, window)
+
+	if prefetch:
+		chunks = _prefetch_chunks(chunks, prefetch)
+	return chunks
+
+# function [accumulator] = accumulate(accumulator, chunks)
+
+#  feeds all the chunks of a trace set into an accumulator
+#
+#  DESCRIPTION:
+#
+#  accumulate(accumulator, chunks)
+#
+#  calls accumulator.update(traces, inputs) for every chunk, e.g. of
+#  trace_chunks, and returns the accumulator.
+#
+#  EXAMPLE:
+#
+#  classification_output = accumulate(CpaAccumulator(11), trace_chunks('WS2')).correlation()
+
+
+def accumulate(accumulator, chunks):
+	for traces, inputs in chunks:
+		accumulator.update(traces, inputs)
+	return accumulator
+
+
+def main():
+	#  python trace_lib.py WS2.mat WS2 [dtype]
+	if len(sys.argv) not in (3, 4):
+		print('usage: python trace_lib.py <file.mat> <store folder> [dtype]')
+		return
+	dtype = sys.argv[3] if len(sys.argv) == 4 else None
+	store = trace_store_from_mat(sys.argv[1], sys.argv[2], dtype)
+	print(sys.argv[2], store.shape, store.traces.dtype, store.keys())
+
+
+if __name__ == '__main__':
+	main()